@@ -0,0 +1,240 @@
+"""
+Transcribes a directory of archived lecture recordings in parallel.
+
+    python batch_transcribe.py recordings/ --out transcripts/ --workers 4
+
+Long files are split at silence into chunks that are fanned out over a pool of worker
+processes and put back together per file. Files whose contents were already transcribed
+(by sha256) are skipped, so the command can be re-run on a growing archive. A lecture's
+audio archive (the <lecture>_audio folder Note_Taker writes with archive_audio=True) counts
+as one recording, so lectures can be re-transcribed later with a bigger model.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from utils.audio_archive import AudioArchive
+from utils.lazy import lazy_import
+from utils.models import DEFAULT_MODEL
+from utils.transcription_pool import init_worker, transcribe_in_worker
+from utils.vad import FRAME_SECONDS
+
+# Only needed to decode the first recording, it brings torch with it
+whisper = lazy_import("whisper")
+
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".m4a", ".flac", ".ogg", ".opus", ".webm", ".mp4"}
+FREQ = 16000
+
+def is_archive(path):
+    return os.path.isfile(os.path.join(path, "info.json")) and os.path.isfile(os.path.join(path, "index.bin"))
+
+def file_hash(path):
+    if os.path.isdir(path):
+        # An archive's audio is all in its data file
+        path = os.path.join(path, "chunks.dat")
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def split_at_silence(audio, chunk_seconds=120, search_seconds=15):
+    """
+    Cuts the audio roughly every chunk_seconds, at the quietest frame in the last
+    search_seconds before each cut so words aren't split between chunks
+    """
+    frame_len = int(FREQ * FRAME_SECONDS)
+    count = len(audio) // frame_len
+    energy = np.mean(audio[:count * frame_len].reshape(count, frame_len) ** 2, axis=1)
+    chunk_frames = max(1, int(chunk_seconds / FRAME_SECONDS))
+    # The search window has to stay inside the chunk or the cut can land before its start
+    search_frames = max(1, min(int(search_seconds / FRAME_SECONDS), chunk_frames // 2))
+
+    chunks = []
+    start = 0
+    while count - start > chunk_frames:
+        lo = start + chunk_frames - search_frames
+        cut = max(start + 1, lo + int(np.argmin(energy[lo:start + chunk_frames])))
+        chunks.append(audio[start * frame_len:cut * frame_len])
+        start = cut
+    chunks.append(audio[start * frame_len:])
+    return chunks
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, "manifest.json"), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def load_recording(path):
+    if not os.path.isdir(path):
+        return whisper.load_audio(path)
+    # Read-only, the lecture may still be recording into it
+    archive = AudioArchive(path, readonly=True)
+    try:
+        return archive.read()
+    finally:
+        archive.close()
+
+def find_recordings(directory):
+    for root, dirs, files in os.walk(directory):
+        archives = sorted(name for name in dirs if is_archive(os.path.join(root, name)))
+        for name in archives:
+            yield os.path.join(root, name)
+        # The chunks inside an archive aren't recordings of their own
+        dirs[:] = [name for name in dirs if name not in archives]
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS:
+                yield os.path.join(root, name)
+
+def transcribe_directory(directory, out_dir, workers, model_name=DEFAULT_MODEL, chunk_seconds=120):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    start_time = time.time()
+    audio_seconds = 0.0
+
+    # Per file: chunk texts, how many chunks are still running, which ones failed and where the transcript goes
+    jobs = {}
+    running = {}
+    failed_files = []
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    executor = None
+    # Bumped every time the pool is replaced, a future from an older pool doesn't replace it again
+    generation = 0
+
+    def start_executor():
+        nonlocal executor, generation
+        if executor is not None:
+            executor.shutdown(wait=False)
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=init_worker, initargs=(model_name, threads))
+        generation += 1
+
+    def submit(digest, index):
+        chunk = jobs[digest]["chunks"][index]
+        try:
+            future = executor.submit(transcribe_in_worker, chunk)
+        except BrokenProcessPool:
+            # A worker died (killed, out of memory), the rest of the chunks go to a fresh pool
+            print("A transcription worker died, starting a new pool")
+            start_executor()
+            future = executor.submit(transcribe_in_worker, chunk)
+        running[future] = (digest, index, generation)
+
+    def finish(future):
+        digest, index, future_generation = running.pop(future)
+        job = jobs[digest]
+        try:
+            job["texts"][index] = future.result().strip()
+        except BrokenProcessPool as e:
+            if index not in job["retried"]:
+                # Every chunk that was in the dead pool ends up here, it may not have been the one that killed it
+                job["retried"].add(index)
+                if future_generation == generation:
+                    print("A transcription worker died, starting a new pool")
+                    start_executor()
+                submit(digest, index)
+                return
+            print(f"Error transcribing chunk {index} of {job['source']}: {str(e)}")
+            job["failed"].append(index)
+        except Exception as e:
+            print(f"Error transcribing chunk {index} of {job['source']}: {str(e)}")
+            job["failed"].append(index)
+        job["left"] -= 1
+        if job["left"] == 0:
+            del jobs[digest]
+            if job["failed"]:
+                # Left out of the manifest so the next run tries the whole file again
+                failed_files.append(job["source"])
+                print(f"Failed {job['source']}, {len(job['failed'])} of {len(job['texts'])} chunks had errors")
+                return
+            with open(job["out"], "w") as f:
+                f.write(" ".join(text for text in job["texts"] if text) + "\n")
+            manifest[digest] = {"source": job["source"], "transcript": job["out"], "seconds": job["seconds"]}
+            save_manifest(out_dir, manifest)
+            print(f"Finished {job['source']}")
+
+    start_executor()
+    try:
+        for path in find_recordings(directory):
+            digest = file_hash(path)
+            if digest in jobs or (digest in manifest and os.path.exists(manifest[digest]["transcript"])):
+                print(f"Skipping {path}, already transcribed")
+                continue
+
+            # Keep the pool fed without decoding the whole archive into memory at once
+            while len(running) >= workers * 2:
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+
+            audio = load_recording(path)
+            chunks = split_at_silence(audio, chunk_seconds)
+            seconds = len(audio) / FREQ
+            audio_seconds += seconds
+            # Mirror the recordings' folder layout so equal file names in different folders don't clash
+            out_path = os.path.join(out_dir, os.path.splitext(os.path.relpath(path, directory))[0] + ".txt")
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            # The chunks are kept until the file is done in case a dead worker took one with it
+            jobs[digest] = {"source": path, "out": out_path, "seconds": seconds, "chunks": chunks,
+                            "texts": [""] * len(chunks), "left": len(chunks), "failed": [], "retried": set()}
+            print(f"Queued {path}: {seconds / 60:.1f} minutes in {len(chunks)} chunks")
+            for index in range(len(chunks)):
+                submit(digest, index)
+
+        while running:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(future)
+    finally:
+        executor.shutdown(wait=True)
+
+    elapsed = time.time() - start_time
+    speed = audio_seconds / elapsed if elapsed > 0 else 0.0
+    print(f"Transcribed {audio_seconds / 3600:.2f} hours of audio in {elapsed / 3600:.2f} hours "
+          f"({speed:.1f} audio-hours per wall-clock hour)")
+    if failed_files:
+        print(f"{len(failed_files)} recordings failed and will be retried on the next run:")
+        for path in failed_files:
+            print(f"  {path}")
+    return speed, failed_files
+
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive, got {value}")
+    return number
+
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive, got {value}")
+    return number
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe a directory of lecture recordings")
+    parser.add_argument("directory", help="directory of audio files, searched recursively")
+    parser.add_argument("--out", default="transcripts", help="where transcripts and the manifest are written")
+    parser.add_argument("--workers", type=positive_int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--chunk-seconds", type=positive_float, default=120)
+    args = parser.parse_args()
+    speed, failed_files = transcribe_directory(args.directory, args.out, args.workers, args.model, args.chunk_seconds)
+    if failed_files:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+End-to-end benchmark of the live pipeline on canned audio, no microphone or Ollama needed.
+
+    python benchmark.py --audio utils/recording.wav --synthetic 10 --out benchmark.json
+
+Each recording is replayed into the audio stream and goes through the same path as a lecture:
+record_segment -> file_queue -> TranscriptionThread -> transcription_to_notes -> compound_notes,
+with the LLM replaced by a local stub server. Reports whisper's real-time factor, the transcription
+queue depth over time, LLM time to first token and the latency from a segment being cut (the speaker
+pausing) to its transcript and to the notes written from it, as JSON so runs can be compared.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+import whisper
+from scipy.io import wavfile
+from utils import llm, metrics, models, transcribe
+from utils.llm import LLMClient
+from utils.log_sink import LogSink
+from utils.ollama_stub import StubOllama
+from utils.record import ReplayAudioStream, WHISPER_FREQ
+from note_taker import Note_Taker
+
+def load_recording(path):
+    """
+    Returns (audio, freq), wav files keep their own rate and channels, anything else is decoded by whisper at 16 kHz mono
+    """
+    if os.path.splitext(path)[1].lower() != ".wav":
+        return whisper.load_audio(path), WHISPER_FREQ
+    freq, audio = wavfile.read(path)
+    if np.issubdtype(audio.dtype, np.integer):
+        audio = audio / float(np.iinfo(audio.dtype).max)
+    return audio.astype(np.float32), freq
+
+def synthetic_lecture(seconds, freq=WHISPER_FREQ, seed=0):
+    """
+    Speech-like audio for long runs: voiced bursts of a few harmonics with a wobbling pitch and
+    syllable-rate envelope, separated by short pauses over a low noise floor
+    """
+    rng = np.random.default_rng(seed)
+    audio = rng.normal(0, 0.001, int(seconds * freq)).astype(np.float32)
+    pos = 0
+    while pos < len(audio):
+        length = int(rng.uniform(0.5, 4.0) * freq)
+        t = np.arange(length) / freq
+        pitch = rng.uniform(100, 220) * (1 + 0.05 * np.sin(2 * np.pi * rng.uniform(2, 5) * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / freq
+        burst = sum(np.sin(k * phase) / k for k in range(1, 6))
+        envelope = 0.5 * (1 + np.sin(2 * np.pi * rng.uniform(3, 6) * t))
+        end = min(pos + length, len(audio))
+        audio[pos:end] += (0.1 * burst * envelope)[:end - pos]
+        pos = end + int(rng.uniform(0.3, 1.2) * freq)
+    return audio
+
+def distribution(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"count": len(values), "mean": float(np.mean(values)), "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)), "max": float(np.max(values))}
+
+
+class Probe:
+    """
+    Timestamps every segment on its way through the pipeline by wrapping the functions it passes
+    through for the length of one run: queue_segment (cut), the segment's write (transcribed),
+    the store's peek and commit (picked up for notes) and the notes listener (notes written)
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.lock = threading.Lock()
+        self.segments = []
+        self.inference = []
+        self.unconsumed = []
+        # Segments taken by a transcription_to_notes call, keyed by the thread running it
+        self.batches = {}
+        self.peeked = {}
+        self.queue_depth = []
+        self.sampling = False
+
+    def install(self, note_taker):
+        self.original_queue_segment = transcribe.queue_segment
+        self.original_transcribe = models.transcribe
+        transcribe.queue_segment = self.queue_segment
+        models.transcribe = self.transcribe
+        peek, commit = note_taker.store.peek, note_taker.store.commit
+        note_taker.store.peek = lambda: self.peek(peek)
+        note_taker.store.commit = lambda last_id: self.commit(commit, last_id)
+        note_taker.add_notes_listener(self.notes_changed)
+
+    def uninstall(self):
+        transcribe.queue_segment = self.original_queue_segment
+        models.transcribe = self.original_transcribe
+
+    def now(self):
+        return time.time() - self.start
+
+    def queue_segment(self, audio, write):
+        segment = {"seconds": len(audio) / WHISPER_FREQ, "queued": self.now(),
+                   "transcribed": None, "consumed": None, "noted": None}
+        with self.lock:
+            self.segments.append(segment)
+
+        def written(text):
+            # Under the lock so a peek can't take the text without the segment
+            with self.lock:
+                write(text)
+                segment["transcribed"] = self.now()
+                self.unconsumed.append(segment)
+
+        return self.original_queue_segment(audio, written)
+
+    def transcribe(self, audio, *args, **kwargs):
+        start = time.time()
+        result = self.original_transcribe(audio, *args, **kwargs)
+        if not isinstance(audio, str):
+            with self.lock:
+                self.inference.append((len(audio) / WHISPER_FREQ, time.time() - start))
+        return result
+
+    def peek(self, peek):
+        with self.lock:
+            text, last_id = peek()
+            batch = list(self.unconsumed)
+            # Stay unconsumed until commit, a failed generation picks the same ones up again
+            self.peeked[threading.get_ident()] = len(batch)
+            for segment in batch:
+                if segment["consumed"] is None:
+                    segment["consumed"] = self.now()
+            if text.strip():
+                self.batches[threading.get_ident()] = batch
+        return text, last_id
+
+    def commit(self, commit, last_id):
+        with self.lock:
+            commit(last_id)
+            # Only commit takes segments off the front, the peeked ones are still the first ones
+            del self.unconsumed[:self.peeked.pop(threading.get_ident(), 0)]
+
+    def notes_changed(self, kind, text):
+        # The notes are finished with the newline written after the response
+        if kind == "append" and text == "\n":
+            with self.lock:
+                for segment in self.batches.pop(threading.get_ident(), []):
+                    segment["noted"] = self.now()
+
+    def sample_queue(self, interval):
+        self.sampling = True
+
+        def run():
+            while self.sampling:
+                self.queue_depth.append((round(self.now(), 2), transcribe.file_queue.qsize()))
+                time.sleep(interval)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+
+def run_benchmark(name, audio, freq, speed=1.0, segment_seconds=60, notes_min_tokens=1000,
+                  ttft=0.2, tokens_per_second=50.0, sample_interval=0.5):
+    """
+    Replays one recording through the whole pipeline and returns its results
+    """
+    with StubOllama(ttft=ttft, tokens_per_second=tokens_per_second) as stub:
+        llm.default_client = LLMClient(host=stub.url)
+        note_taker = Note_Taker(name, LogSink(f"{name}.log"), notes_min_tokens=notes_min_tokens)
+        # Replaces the input device before the first segment opens it
+        stream = note_taker.capture.audio_stream = ReplayAudioStream(audio, freq, speed)
+        start = time.time()
+        probe = Probe(start)
+        probe.install(note_taker)
+        probe.sample_queue(sample_interval)
+        try:
+            while not stream.finished:
+                note_taker.record_segment(segment_seconds)
+            recorded = probe.now()
+            transcribe.file_queue.join()
+            transcribed = probe.now()
+
+            # Turn the rest into notes like the Generate button, after any generation still running
+            note_taker.generate_notes(wait=True)
+            note_taker.scheduler.stop()
+            noted = probe.now()
+            notes_requests = list(note_taker.llm.stats)
+
+            compound_start = time.time()
+            note_taker.compound_notes()
+            compound_seconds = time.time() - compound_start
+        finally:
+            probe.sampling = False
+            probe.uninstall()
+        compound_requests = list(note_taker.llm.stats)[len(notes_requests):]
+
+    audio_seconds = len(audio) / freq
+    inference_audio = sum(seconds for seconds, _ in probe.inference)
+    inference_seconds = sum(elapsed for _, elapsed in probe.inference)
+    segments = probe.segments
+    return {
+        "name": name,
+        "audio_seconds": audio_seconds,
+        "speed": speed,
+        "vad": transcribe.use_vad,
+        "timeline": {"recorded": recorded, "transcribed": transcribed, "noted": noted,
+                     "compound_seconds": compound_seconds, "total": probe.now()},
+        "whisper": {
+            "model": transcribe.model_name,
+            "segments": len(probe.inference),
+            "audio_seconds": inference_audio,
+            "inference_seconds": inference_seconds,
+            "rtf": inference_seconds / inference_audio if inference_audio else None,
+        },
+        "queue_depth": {"max": max((depth for _, depth in probe.queue_depth), default=0),
+                        "samples": probe.queue_depth},
+        "llm": {
+            "stub": {"ttft": ttft, "tokens_per_second": tokens_per_second, "max_concurrent": stub.max_active},
+            "notes_ttft": distribution([r["ttft"] for r in notes_requests]),
+            "notes_prompt_chars": distribution([r["prompt_chars"] for r in notes_requests]),
+            "compound_ttft": distribution([r["ttft"] for r in compound_requests]),
+            "requests": notes_requests + compound_requests,
+        },
+        "latency": {
+            "segment_seconds": distribution([s["seconds"] for s in segments]),
+            "to_transcript": distribution([s["transcribed"] - s["queued"] for s in segments if s["transcribed"]]),
+            "to_notes": distribution([s["noted"] - s["queued"] for s in segments if s["noted"]]),
+            "segments": segments,
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the transcription and notes pipeline on canned audio")
+    parser.add_argument("--audio", action="append", default=None,
+                        help="recording to replay, can be given more than once (default utils/recording.wav)")
+    parser.add_argument("--synthetic", type=float, action="append", default=[],
+                        help="also run a synthetic recording of this many minutes, can be given more than once")
+    parser.add_argument("--repeat", type=int, default=1, help="tile each recording this many times")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 1 is real time like a live lecture")
+    parser.add_argument("--model", default=transcribe.model_name)
+    parser.add_argument("--no-vad", action="store_true", help="queue fixed-length segments instead of cutting at pauses")
+    parser.add_argument("--segment-seconds", type=float, default=60)
+    parser.add_argument("--notes-min-tokens", type=int, default=1000, help="transcript tokens that trigger notes")
+    parser.add_argument("--ttft", type=float, default=0.2, help="stub LLM time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="stub LLM generation speed")
+    parser.add_argument("--out", default="benchmark.json")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    recordings = [(os.path.splitext(os.path.basename(path))[0], *load_recording(os.path.abspath(path)))
+                  for path in (args.audio or [os.path.join(here, "utils", "recording.wav")])]
+    recordings += [(f"synthetic-{minutes:g}min", synthetic_lecture(minutes * 60), WHISPER_FREQ)
+                   for minutes in args.synthetic]
+    out_path = os.path.abspath(args.out)
+
+    transcribe.model_name = args.model
+    transcribe.use_vad = not args.no_vad
+    # Model loading isn't part of the pipeline's steady state
+    models.warm_up(args.model)
+
+    # Notes, transcripts and the response cache go in a scratch directory so nothing is reused between runs
+    os.chdir(tempfile.mkdtemp(prefix="note_taker_benchmark_"))
+    results = []
+    for name, audio, freq in recordings:
+        if args.repeat > 1:
+            audio = np.concatenate([audio] * args.repeat)
+        print(f"Running {name}: {len(audio) / freq:.0f} seconds of audio at {args.speed:g}x")
+        result = run_benchmark(name, audio, freq, args.speed, args.segment_seconds, args.notes_min_tokens,
+                               args.ttft, args.tokens_per_second)
+        if not result["whisper"]["segments"] and transcribe.use_vad:
+            # A run that never reaches whisper or the LLM measures nothing, so the recording
+            # goes through again as fixed-length segments. The result says which path it took
+            print("  the VAD found no speech in the recording, running it again without VAD")
+            transcribe.use_vad = False
+            try:
+                result = run_benchmark(f"{name}-no-vad", audio, freq, args.speed, args.segment_seconds,
+                                       args.notes_min_tokens, args.ttft, args.tokens_per_second)
+            finally:
+                transcribe.use_vad = True
+        results.append(result)
+        latency = result["latency"]["to_notes"]
+        print(f"  whisper rtf {result['whisper']['rtf'] or 0:.3f}, max queue depth {result['queue_depth']['max']}, "
+              f"speech to notes p50 {latency['p50'] if latency else float('nan'):.1f}s")
+
+    with open(out_path, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "runs": results,
+                   "metrics": metrics.registry.snapshot()}, f, indent=2)
+    print(f"Results written to {out_path}")
+
+if __name__ == "__main__":
+    main()
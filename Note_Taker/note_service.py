@@ -0,0 +1,337 @@
+"""
+Headless note taking service that records and takes notes for several lectures at once.
+
+    python note_service.py --port 8765 --workers 2
+    python note_service.py --socket /tmp/note_service.sock
+
+Every session has its own input device, transcript and notes, while whisper (a shared thread or
+worker pool) and the LLM client are shared by all of them. Controlled through a local JSON API:
+
+    GET    /sessions                    status of every session
+    POST   /sessions                    start one: {"lecture": "Calculus 3", "device": 2, "streaming": false,
+                                        "archive": "opus"} (archive is optional, "flac" or "opus")
+    GET    /sessions/<lecture>          status of one session
+    POST   /sessions/<lecture>/stop     stop recording, the rest of the transcript is turned into notes
+    POST   /sessions/<lecture>/start    start recording again
+    GET    /sessions/<lecture>/notes    the notes so far, as text
+    POST   /sessions/<lecture>/notes    generate notes from the pending transcript now
+    DELETE /sessions/<lecture>          stop and close the session
+    GET    /metrics                     Prometheus metrics for the whole service
+"""
+import argparse
+import json
+import os
+import signal
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+from note_taker import Note_Taker
+from utils import metrics, transcribe
+from utils.llm import get_client
+from utils.log_sink import LogSink
+
+def valid_lecture_name(lecture):
+    """
+    Lecture names become file names (notes, transcript, log, audio archive), so they can't be a path
+    """
+    if not isinstance(lecture, str) or not lecture.strip() or ".." in lecture or "\0" in lecture:
+        return False
+    return not any(sep in lecture for sep in ("/", "\\", os.sep, os.altsep) if sep)
+
+
+class Session:
+    """
+    One lecture hosted by the service, a Note_Taker with its own recording thread and log
+    """
+
+    def __init__(self, lecture, device=None, streaming=False, segment_seconds=60, archive=None):
+        self.lecture = lecture
+        self.device = device
+        self.segment_seconds = segment_seconds
+        self.log = LogSink(f"{lecture}.log", max_lines=200)
+        self.note_taker = Note_Taker(lecture, self.log, streaming=streaming, device=device,
+                                     archive_audio=archive is not None, archive_format=archive or "flac")
+        self.created = time.time()
+        self.recording = False
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.recording:
+                return
+            self.recording = True
+            self.note_taker.start_recording()
+            self.thread = threading.Thread(target=self.record_loop, name=f"record-{self.lecture}")
+            self.thread.daemon = True  # Thread will exit when main program exits
+            self.thread.start()
+        self.log.log("Recording started")
+
+    def record_loop(self):
+        while self.recording:
+            try:
+                self.note_taker.record_segment(self.segment_seconds)
+            except Exception as e:
+                self.log.log(f"Error recording: {str(e)}")
+                self.recording = False
+                break
+            stream = self.note_taker.capture.audio_stream
+            if self.recording and stream is not None and not stream.running:
+                # The device went away (or a replayed recording ended) without stop() being called
+                self.log.log("Audio stream ended")
+                self.recording = False
+                self.finish_notes()
+
+    def stop(self):
+        with self.lock:
+            if not self.recording:
+                return
+            self.recording = False
+            thread = self.thread
+        # Stopping the device wakes the thread up instead of waiting out the segment
+        self.note_taker.stop_recording()
+        thread.join()
+        self.finish_notes()
+        self.log.log("Recording stopped")
+
+    def finish_notes(self):
+        """
+        Waits for the last segments to be transcribed, then turns the rest of the transcript into notes
+        """
+        self.note_taker.wait_for_transcript()
+        try:
+            self.note_taker.generate_notes(wait=True)
+        except Exception as e:
+            self.log.log(f"Error generating notes: {str(e)}")
+
+    def close(self):
+        self.stop()
+        # A stream that ended on its own finishes its notes on the recording thread
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self.note_taker.close()
+
+    def notes(self):
+        return self.note_taker.retrieve_all_notes()
+
+    def status(self):
+        scheduler = self.note_taker.scheduler
+        # Nothing else reads the log, draining just moves the lines into its history
+        self.log.drain()
+        return {
+            "lecture": self.lecture,
+            "course": self.note_taker.course,
+            "device": self.device,
+            "recording": self.recording,
+            "created": self.created,
+            "pending_tokens": self.note_taker.pending_tokens(),
+            "generating_notes": scheduler.generating,
+            "notes_generated": scheduler.runs,
+            "archived_seconds": self.note_taker.archive.duration() if self.note_taker.archive else None,
+            "log": list(self.log.history)[-10:],
+        }
+
+
+class NoteService:
+    """
+    Keeps the sessions by lecture name, everything here is safe to call from the API's threads
+    """
+
+    def __init__(self, segment_seconds=60):
+        self.segment_seconds = segment_seconds
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def create(self, lecture, device=None, streaming=False, record=True, archive=None):
+        if not valid_lecture_name(lecture):
+            raise ValueError(f"Invalid lecture name {lecture!r}")
+        with self.lock:
+            if lecture in self.sessions:
+                raise ValueError(f"Session {lecture} already exists")
+            session = Session(lecture, device, streaming, self.segment_seconds, archive)
+            self.sessions[lecture] = session
+        if record:
+            session.start()
+        return session
+
+    def get(self, lecture):
+        with self.lock:
+            session = self.sessions.get(lecture)
+        if session is None:
+            raise KeyError(lecture)
+        return session
+
+    def remove(self, lecture):
+        with self.lock:
+            session = self.sessions.pop(lecture, None)
+        if session is None:
+            raise KeyError(lecture)
+        session.close()
+
+    def status(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        llm = get_client()
+        return {
+            "uptime": time.time() - self.started,
+            "transcription_lag": transcribe.transcription_lag(),
+            "queue_depth": transcribe.file_queue.qsize(),
+            "llm": {"busy": llm.busy(), **llm.summary()},
+            "sessions": [session.status() for session in sessions],
+        }
+
+    def stop_all(self):
+        """
+        Stops recording in every session, each one's last segments are transcribed and turned into notes
+        """
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.stop()
+
+    def shutdown(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def reply(self, code, body, content_type="application/json"):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def route(self):
+        parts = [unquote(part) for part in self.path.split("?")[0].strip("/").split("/") if part]
+        return parts
+
+    def handle_request(self, method):
+        parts = self.route()
+        try:
+            if parts == ["metrics"] and method == "GET":
+                return self.reply(200, metrics.registry.prometheus(), "text/plain; version=0.0.4")
+            if parts == ["sessions"] and method == "GET":
+                return self.reply(200, self.service.status())
+            if parts == ["sessions"] and method == "POST":
+                body = self.read_json()
+                if not body.get("lecture"):
+                    return self.reply(400, {"error": "lecture is required"})
+                if not valid_lecture_name(body["lecture"]):
+                    return self.reply(400, {"error": "lecture can't contain path separators or .."})
+                session = self.service.create(body["lecture"], body.get("device"), bool(body.get("streaming")),
+                                              body.get("record", True), body.get("archive"))
+                return self.reply(201, session.status())
+            if len(parts) >= 2 and parts[0] == "sessions":
+                session = self.service.get(parts[1])
+                action = parts[2] if len(parts) > 2 else None
+                if action is None and method == "GET":
+                    return self.reply(200, session.status())
+                if action is None and method == "DELETE":
+                    self.service.remove(parts[1])
+                    return self.reply(200, {"closed": parts[1]})
+                if action == "start" and method == "POST":
+                    session.start()
+                    return self.reply(200, session.status())
+                if action == "stop" and method == "POST":
+                    session.stop()
+                    return self.reply(200, session.status())
+                if action == "notes" and method == "GET":
+                    return self.reply(200, session.notes(), "text/plain; charset=utf-8")
+                if action == "notes" and method == "POST":
+                    session.note_taker.generate_notes()
+                    return self.reply(202, session.status())
+            return self.reply(404, {"error": "not found"})
+        except KeyError as e:
+            return self.reply(404, {"error": f"no session {e.args[0]}"})
+        except ValueError as e:
+            return self.reply(409, {"error": str(e)})
+        except Exception as e:
+            print(f"Error handling {method} {self.path}: {str(e)}")
+            return self.reply(500, {"error": str(e)})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+def make_server(service, host="127.0.0.1", port=8765, socket_path=None):
+    handler = type("Handler", (ServiceHandler,), {"service": service})
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the note taker as a service for several lectures at once")
+    parser.add_argument("--host", default="127.0.0.1", help="only local clients by default")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", default=None, help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=transcribe.transcription_workers,
+                        help="whisper worker processes shared by all sessions")
+    parser.add_argument("--model", default=transcribe.model_name)
+    parser.add_argument("--segment-seconds", type=float, default=60)
+    args = parser.parse_args()
+
+    transcribe.transcription_workers = args.workers
+    transcribe.model_name = args.model
+    transcribe.warm_up_model()
+    metrics.registry.start_writer("metrics.prom")
+
+    service = NoteService(args.segment_seconds)
+    server = make_server(service, args.host, args.port, args.socket)
+    print(f"Note service listening on {args.socket or f'http://{args.host}:{args.port}'}")
+
+    def shut_down(signum, frame):
+        # serve_forever has to be stopped from another thread
+        threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, shut_down)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        # Everything recorded is transcribed before the transcripts are closed
+        service.stop_all()
+        transcribe.file_queue.join()
+        service.shutdown()
+        metrics.registry.stop_writer()
+        if args.socket:
+            os.remove(args.socket)
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,286 @@
-from utils.transcribe import record_and_transcribe, clear_transcription, retrieve_transcription, transcribe
-import ollama, time
+from utils.transcribe import CaptureSession, transcribe
+from utils.transcript_store import TranscriptStore
+from utils.note_context import split_sections, select_sections, estimate_tokens, CHARS_PER_TOKEN
+from utils.notes_scheduler import NotesScheduler
+from utils.think_filter import strip_think
+from utils.llm import get_client
+from utils.llm_cache import get_cache
+from utils.search_index import get_search_index
+from utils.embedding_index import get_embedding_index, course_name, EMBED_MODEL
+from utils.audio_archive import AudioArchive
+from utils import metrics
+import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+
+NOTES_MODEL = 'gemma3n:e4b'
+# Bump a template's version when its prompt changes so cached responses to the old prompt aren't reused
+NOTES_TEMPLATE = 'notes-v2'
+SUMMARY_TEMPLATE = 'summary-v1'
+CONDENSE_TEMPLATE = 'condense-v1'
+COMPOUND_TEMPLATE = 'compound-v1'
+
+NOTES_SECONDS = metrics.histogram("note_taker_notes_seconds", "Time to turn one batch of transcript into notes")
+NOTES_TRANSCRIPT_CHARS = metrics.histogram("note_taker_notes_transcript_chars", "Transcript characters per notes batch",
+                                           (500, 1000, 2000, 4000, 8000, 16000, 32000))
 
 class Note_Taker:
 
-    def __init__(self, lecture_name, debug_func):
+    def __init__(self, lecture_name, debug_func, streaming=False, context_tokens=2000, recent_sections=3,
+                 notes_min_tokens=1000, notes_max_tokens=4000, course=None, related_sections=3, device=None,
+                 archive_audio=False, archive_format="flac"):
         """
         Creates a note taker class, lecture_name is the name of the file excluding the .txt extension 
+        streaming transcribes short overlapping windows as the lecture goes instead of whole segments
+        context_tokens caps how much of the existing notes goes into each prompt, None sends all of them
+        notes are generated once notes_min_tokens of transcript are waiting and the LLM is free,
+        or once notes_max_tokens are waiting either way
+        up to related_sections sections from earlier lectures of the same course go into each prompt,
+        the course defaults to the lecture name without its number ("Calculus 3" is Calculus)
+        device is the sounddevice input to record from, None for the default one
+        archive_audio keeps the captured audio in lecture_name_audio/ as compressed chunks
+        (archive_format "flac" or the smaller "opus") so it can be re-transcribed later, needs soundfile
         """
         self.note_name = lecture_name + ".txt"
+        self.summary_name = lecture_name + "_summary.json"
         self.lecture_name = lecture_name
         self.debug_func = debug_func
+        self.streaming = streaming
+        self.context_tokens = context_tokens
+        self.recent_sections = recent_sections
+        # One client per process, loading the model now means the first notes don't wait for it
+        self.llm = get_client()
+        self.llm.preload_in_background(NOTES_MODEL)
+        self.cache = get_cache()
+        self.search_index = get_search_index()
+        self.course = course or course_name(lecture_name)
+        self.related_sections = related_sections
+        self.embeddings = get_embedding_index()
+        self.notes_listeners = []
+        # Each lecture gets its own transcript instead of sharing transcription.txt,
+        # and its own input stream so several lectures can record at once
+        self.store = TranscriptStore(lecture_name + "_transcript.db")
+        self.archive = AudioArchive(lecture_name + "_audio", archive_format) if archive_audio else None
+        self.capture = CaptureSession(device, archive=self.archive)
+        # Held while the notes file is being added to or rewritten
+        self.notes_lock = threading.Lock()
+        self.scheduler = NotesScheduler(self.transcription_to_notes, self.pending_tokens, self.llm.busy,
+                                        notes_min_tokens, notes_max_tokens)
         pass
  
-    def record_segment(self, seconds, transfer_len_limit=4000):
-        record_and_transcribe(seconds)
-        transcription = retrieve_transcription()
-        trans_len = len(transcription)
+    def record_segment(self, seconds):
+        if self.streaming:
+            self.capture.stream_and_transcribe(seconds, self.store.append, on_partial=self.show_partial)
+        else:
+            self.capture.record_and_transcribe(seconds, self.store.append)
+        trans_len = self.store.pending_length()
         print(f"transcription length: {trans_len}")
         self.debug_func(f"transcription length: {trans_len}")
-        if trans_len > transfer_len_limit:
-            notes_thread = threading.Thread(target=self.transcription_to_notes)
-            notes_thread.daemon = True  # Thread will exit when main program exits
-            notes_thread.start()
+        # The scheduler decides whether that's enough for notes yet
+        self.scheduler.poke()
         return
-    
+
+    def pending_tokens(self):
+        return self.store.pending_length() // CHARS_PER_TOKEN
+
+    def generate_notes(self, wait=False):
+        """
+        Turns all the transcript waiting so far into notes without waiting for enough to build up,
+        with wait=True returns once they're written and raises if that failed
+        """
+        return self.scheduler.request(wait)
+
+    def add_notes_listener(self, callback):
+        """
+        callback(kind, text) is called from whichever thread writes the notes. kind is "append" with
+        just the new text, or "rewrite" with the whole notes after they were replaced
+        """
+        self.notes_listeners.append(callback)
+
+    def notify_notes(self, kind, text):
+        for callback in self.notes_listeners:
+            try:
+                callback(kind, text)
+            except Exception as e:
+                print(f"Error in notes listener: {str(e)}")
+
+    def show_partial(self, text):
+        if text:
+            self.debug_func(f"... {text}")
+
+    def start_recording(self):
+        """
+        Allows audio capture again after stop_recording(), call before the first record_segment of a recording
+        """
+        self.capture.start_recording()
+
+    def stop_recording(self):
+        """
+        Stops audio capture, the segment currently being recorded is cut short and still transcribed
+        """
+        self.capture.stop_recording()
+
+    def wait_for_transcript(self, timeout=None):
+        """
+        Blocks until every segment recorded so far is in the transcript, returns False if the timeout ran out
+        """
+        return self.capture.wait_until_written(timeout)
+
+    def close(self):
+        """
+        Stops recording and the notes scheduler and closes the transcript and audio archive, for a service
+        that's done with this lecture. Notes already being generated or requested are finished first
+        """
+        self.capture.close()
+        self.scheduler.stop(wait=True)
+        with self.notes_lock:
+            self.store.close()
+
     def transcription_to_notes(self):
         """
-        Uses Ollama to summarize the main transcription
-        """
-        self.debug_func("Starting Transcription -> Notes")
-        transcription = retrieve_transcription()
-        clear_transcription()
-        start_time = time.time()
-        stream = ollama.chat(
-        model='gemma3n:e4b',
-        messages=[
-                {
-                    'role': 'user',
-                    'content': f'Here are the notes created so far: {self.retrieve_all_notes()}, Don\'t include timestamps in your response. Create an addition to the notes for this college class about {self.lecture_name} using this whisper transcription for a portion of the class: {transcription}',
-                },
-        ],
-        stream=True,
-        )
-        msg = ""
-        full_msg = ""
-        for chunk in stream:
-            msg += chunk['message']['content']
-            full_msg += chunk['message']['content']
-            while msg.__contains__("</think>"):
-                think_index = str(msg).index("</think>")
-                msg = msg[think_index + 8:]
-        while msg.__contains__("</think>"):
-            think_index = str(msg).index("</think>")
-            msg = msg[think_index + 8:]
-        while msg.__contains__("<think>"):
-            think_index = str(msg).index("<think>")
-            msg = msg[think_index + 7:]
-        print(f"Deciding if response took {time.time() - start_time:.1f} seconds with ai response being: {full_msg}")
-        self.debug_func("Finished Transcription -> Notes")
+        Uses Ollama to summarize the main transcription. Normally run by the scheduler, holds
+        notes_lock so it never overlaps another generation or compound_notes
+        """
+        with self.notes_lock:
+            self.debug_func("Starting Transcription -> Notes")
+            # Everything since the last notes, segments written meanwhile wait for the next call. The
+            # cursor only moves once the notes are written, if the LLM fails it's all still there
+            transcription, last_id = self.store.peek()
+            if not transcription.strip():
+                self.store.commit(last_id)
+                self.debug_func("No new transcription to turn into notes")
+                return
+            start_time = time.time()
+            related = self.related_notes(transcription)
+            if related:
+                related = f' Here are related notes from earlier {self.course} lectures, for context only: {related}.'
+            stream = self.cached_chat(NOTES_TEMPLATE,
+                f'Here are the notes created so far: {self.notes_context(transcription)},{related} Don\'t include timestamps in your response. Create an addition to the notes for this college class about {self.lecture_name} using this whisper transcription for a portion of the class: {transcription}')
+            # Tokens go into the notes file as they arrive so the GUI can show them straight away.
+            # It's only opened once the first one does, a request that fails outright leaves no trace
+            token_count = 0
+            f = None
+            try:
+                for token in stream:
+                    if f is None:
+                        f = open(self.note_name, "a")
+                    f.write(token)
+                    f.flush()
+                    self.notify_notes("append", token)
+                    token_count += 1
+            finally:
+                if f is not None:
+                    f.write("\n")
+                    f.close()
+                    self.notify_notes("append", "\n")
+            if f is None:
+                raise RuntimeError("The LLM returned no notes")
+            self.store.commit(last_id)
+            NOTES_SECONDS.observe(time.time() - start_time)
+            NOTES_TRANSCRIPT_CHARS.observe(len(transcription))
+            print(f"Deciding if response took {time.time() - start_time:.1f} seconds for {token_count} chunks")
+            self.debug_func("Finished Transcription -> Notes")
+            self.update_search_index()
+            if self.context_tokens is not None:
+                self.update_summary()
+            return
+
+    def update_search_index(self):
+        """
+        Brings this lecture's notes and transcript in the search index up to date, only changed
+        sections and new segments are written. Search problems never stop notes from being taken
+        """
+        notes = self.retrieve_all_notes()
         try:
-            with open(self.note_name, "a") as f:
-                f.write(msg + "\n")
+            self.search_index.update_notes(self.lecture_name, notes)
+            self.search_index.update_transcript(self.lecture_name, self.store)
+        except Exception as e:
+            print(f"Error updating search index: {str(e)}")
+        try:
+            self.embeddings.update_sections(self.lecture_name, self.course, split_sections(notes), self.embed)
+        except Exception as e:
+            print(f"Error updating embeddings: {str(e)}")
+
+    def embed(self, texts):
+        return self.llm.embed(EMBED_MODEL, texts)
+
+    def related_notes(self, transcription, max_chars=3000):
+        """
+        The sections from earlier lectures of this course closest in meaning to the transcription,
+        empty when there are none or the embedding model isn't available
+        """
+        if not self.related_sections or not self.embeddings.has_candidates(self.course, self.lecture_name):
+            return ""
+        try:
+            query = self.embed([transcription[-4000:]])
+            results = self.embeddings.search(query, self.related_sections, self.course, self.lecture_name,
+                                             min_score=0.3)[0]
+        except Exception as e:
+            print(f"Error finding related notes: {str(e)}")
+            return ""
+        related = []
+        used = 0
+        for score, entry in results:
+            if used + len(entry["text"]) > max_chars and related:
+                break
+            related.append(f'(from {entry["lecture"]}) {entry["text"].strip()}')
+            used += len(entry["text"])
+        return "\n\n".join(related)
+
+    def notes_context(self, transcription):
+        """
+        The notes to show the LLM with a new transcription. In bounded mode that's a rolling summary
+        of the older sections plus the most recent and most relevant sections, so prompt size stays
+        the same however long the lecture gets
+        """
+        if self.context_tokens is None:
+            return self.retrieve_all_notes()
+        summary = self.load_summary()["summary"]
+        budget = max(self.context_tokens - estimate_tokens(summary), self.context_tokens // 2)
+        sections = select_sections(split_sections(self.retrieve_all_notes()), transcription,
+                                   budget, self.recent_sections)
+        if not summary:
+            return sections
+        return f'(summary of the earlier notes) {summary}\n\n(most recent and related notes) {sections}'
+
+    def load_summary(self):
+        try:
+            with open(self.summary_name, 'r') as f:
+                return json.load(f)
         except:
-            file = open(self.note_name, "w")
-            file.write(msg + "\n")
-            file.close()
-        return
+            return {"summarized": 0, "summary": ""}
+
+    def update_summary(self):
+        """
+        Folds sections that dropped out of the recent window into the rolling summary. Each call
+        takes at most context_tokens worth of sections, anything left over goes in next time
+        """
+        sections = split_sections(self.retrieve_all_notes())
+        state = self.load_summary()
+        if state["summarized"] > len(sections):
+            # The notes were rewritten, start the summary over
+            state = {"summarized": 0, "summary": ""}
+        aged = sections[state["summarized"]:len(sections) - self.recent_sections]
+        batch = []
+        used = 0
+        for section in aged:
+            if batch and used + estimate_tokens(section) > self.context_tokens:
+                break
+            batch.append(section)
+            used += estimate_tokens(section)
+        if not batch:
+            return
+
+        self.debug_func("Updating notes summary")
+        words = self.context_tokens // 4
+        summary = "".join(self.cached_chat(SUMMARY_TEMPLATE,
+            f'Here is a summary of the notes so far for a college class about {self.lecture_name}: {state["summary"]} Rewrite it so it also covers these notes, in under {words} words: {"".join(batch)}')).strip()
+        state = {"summarized": state["summarized"] + len(batch), "summary": summary}
+        with open(self.summary_name + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.summary_name + ".tmp", self.summary_name)
     
     def create_test_transcript(self):
         transcribe("Lecture 1 Introduction to CS and Programming Using Python - MIT OpenCourseWare.mp3")
@@ -80,40 +294,91 @@ class Note_Taker:
             return ""
         return text
 
-    def compound_notes(self):
-        start_time = time.time()
-        stream = ollama.chat(
-        model='gemma3n:e4b',
-        messages=[
-                {
-                    'role': 'user',
-                    'content': f'Create a more comprehensive note sheet from these ones: {self.retrieve_all_notes()}, Don\'t include timestamps in your response. These notes are for a college lecture about {self.lecture_name}',
-                },
-        ],
-        stream=True,
-        )
-        msg = ""
-        full_msg = ""
-        file = open(self.note_name, "w")
-        file.write(" ")
-        for chunk in stream:
-            msg += chunk['message']['content']
-            if chunk['message']['content']:
-                file.write(chunk['message']['content'])
-            full_msg += chunk['message']['content']
-            while msg.__contains__("</think>"):
-                think_index = str(msg).index("</think>")
-                msg = msg[think_index + 8:]
-        while msg.__contains__("</think>"):
-            think_index = str(msg).index("</think>")
-            msg = msg[think_index + 8:]
-        while msg.__contains__("<think>"):
-            think_index = str(msg).index("<think>")
-            msg = msg[think_index + 7:]
-        print(f"Deciding if response took {time.time() - start_time:.1f} seconds with ai response being: {full_msg}")
-        file.write(msg + "\n")
-        file.close()
-        return
+    def compound_notes(self, chunk_tokens=3000, concurrency=2):
+        """
+        Rewrites the notes into one comprehensive note sheet. Notes longer than chunk_tokens are first
+        condensed chunk by chunk, `concurrency` requests at a time, until they fit in a single final pass.
+        The result is streamed into a temporary file that only replaces the notes once it's complete.
+        New notes wait until it's done so none are lost when the file is replaced
+        """
+        with self.notes_lock:
+            start_time = time.time()
+            notes = self.retrieve_all_notes()
+            # A few levels is plenty, each one shrinks the notes by about the condensing ratio
+            for level in range(3):
+                chunks = self.chunk_notes(notes, chunk_tokens)
+                if estimate_tokens(notes) <= chunk_tokens or len(chunks) < 2:
+                    break
+                self.debug_func(f"Condensing {len(chunks)} chunks of notes")
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    condensed = list(executor.map(self.condense_chunk, chunks, range(1, len(chunks) + 1),
+                                                  [len(chunks)] * len(chunks)))
+                notes = "\n\n".join(condensed)
+
+            stream = self.cached_chat(COMPOUND_TEMPLATE,
+                f'Create a more comprehensive note sheet from these ones: {notes}, Don\'t include timestamps in your response. These notes are for a college lecture about {self.lecture_name}')
+            temp_name = self.note_name + ".tmp"
+            parts = []
+            try:
+                with open(temp_name, "w") as file:
+                    for token in stream:
+                        file.write(token)
+                        parts.append(token)
+                    file.write("\n")
+                token_count = len(parts)
+                print(f"Deciding if response took {time.time() - start_time:.1f} seconds for {token_count} chunks")
+                if not "".join(parts).strip():
+                    # Replacing the notes with nothing would lose all of them
+                    raise RuntimeError("The LLM returned no notes")
+                # The old notes stay in place until the new ones are complete
+                os.replace(temp_name, self.note_name)
+            finally:
+                if os.path.exists(temp_name):
+                    os.remove(temp_name)
+            self.notify_notes("rewrite", "".join(parts) + "\n")
+            self.update_search_index()
+            # Section numbers changed, the rolling summary has to be rebuilt
+            if os.path.exists(self.summary_name):
+                os.remove(self.summary_name)
+            return
+
+    def chunk_notes(self, notes, chunk_tokens):
+        """
+        Groups whole sections into chunks of at most chunk_tokens
+        """
+        chunks = []
+        current = ""
+        for section in split_sections(notes):
+            if current and estimate_tokens(current + section) > chunk_tokens:
+                chunks.append(current)
+                current = ""
+            current += section
+        if current.strip():
+            chunks.append(current)
+        return chunks
+
+    def condense_chunk(self, chunk, part, parts):
+        return "".join(self.cached_chat(CONDENSE_TEMPLATE,
+            f'These notes are part {part} of {parts} from a college lecture about {self.lecture_name}. Condense them into a comprehensive note sheet that keeps every key point, example and definition, and leaves out repetition. Don\'t include timestamps in your response. {chunk}')).strip()
+
+    def cached_chat(self, template, prompt):
+        """
+        Streams the model's answer to prompt without any reasoning blocks. If the same template
+        version was already run on the same input the cached answer comes back straight away
+        """
+        key = self.cache.key(NOTES_MODEL, template, prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.debug_func("Using cached response")
+            yield cached
+            return
+        parts = []
+        for token in strip_think(self.llm.chat(NOTES_MODEL, [{'role': 'user', 'content': prompt}])):
+            parts.append(token)
+            yield token
+        # An empty answer is a failed call, caching it would replay the failure on every retry
+        if "".join(parts).strip():
+            self.cache.put(key, "".join(parts))
 
 
 
@@ -121,7 +386,7 @@ if __name__ == "__main__":
     n = Note_Taker("test")
     # # for i in range(5):
     # #     n.record_segment(60)
-    # #     print(retrieve_transcription())
+    # #     print(n.store.peek()[0])
     n.compound_notes()
 
 
@@ -2,16 +2,24 @@ import tkinter as tk
 from tkinter import ttk
 import threading
 from note_taker import Note_Taker
+from utils.transcribe import warm_up_model
+from utils.lazy import preload
+from utils.log_sink import LogSink
 
 class NoteTakerGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Lecture Note Taker")
-        self.root.geometry("400x300")
+        self.root.geometry("400x450")
         
         self.note_taker = None
+        # Debug messages go to the log file and, drained on the Tk thread, the log box below
+        self.log_sink = LogSink(max_lines=100)
         self.recording = False
         self.recording_thread = None
+        # Set by the preload thread, only read on the Tk thread
+        self.models_ready = False
+        self.models_error = None
 
         # Create lecture name input
         self.name_frame = ttk.Frame(root)
@@ -32,11 +40,52 @@ class NoteTakerGUI:
         # Status label
         self.status_label = ttk.Label(root, text="Enter lecture name to begin")
         self.status_label.pack(pady=10)
+        self.models_label = ttk.Label(root, text="Loading speech and language models...")
+        self.models_label.pack(pady=5)
+
+        # Debug log, read only
+        self.log_display = tk.Text(root, height=8, wrap=tk.WORD, state=tk.DISABLED)
+        self.log_display.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.root.after(100, self.flush_debug_log)
+
+        # whisper, torch and ollama load once the window is up instead of before it appears
+        self.root.after(0, self.load_models)
+
+    def load_models(self):
+        # Load whisper while the user is still typing a lecture name
+        preload(then=lambda: warm_up_model(background=False), done=self.models_done)
+        self.root.after(200, self.check_models)
+
+    def models_done(self, error):
+        self.models_error = error
+        self.models_ready = True
+
+    def check_models(self):
+        # Tk isn't thread-safe, so poll instead of updating the label from the preload thread
+        if not self.models_ready:
+            self.root.after(200, self.check_models)
+        elif self.models_error is not None:
+            self.models_label.config(text=f"Error loading models: {str(self.models_error)}")
+        else:
+            self.models_label.config(text="Models loaded")
+
+    def flush_debug_log(self):
+        lines = self.log_sink.drain()
+        if lines:
+            self.log_display.config(state=tk.NORMAL)
+            self.log_display.insert(tk.END, "\n".join(lines) + "\n")
+            # Keep as many lines as the sink does
+            extra = int(self.log_display.index("end-1c").split(".")[0]) - 1 - self.log_sink.max_lines
+            if extra > 0:
+                self.log_display.delete("1.0", f"{extra + 1}.0")
+            self.log_display.see(tk.END)
+            self.log_display.config(state=tk.DISABLED)
+        self.root.after(100, self.flush_debug_log)
 
     def create_note_taker(self):
         name = self.lecture_name.get().strip()
         if name:
-            self.note_taker = Note_Taker(name)
+            self.note_taker = Note_Taker(name, self.log_sink.log)
             self.status_label.config(text="Note taker created successfully")
         else:
             self.status_label.config(text="Please enter a lecture name")
@@ -47,13 +96,18 @@ class NoteTakerGUI:
             return
 
         if not self.recording:
+            if not self.models_ready:
+                self.status_label.config(text="Models are still loading, try again in a moment")
+                return
             self.recording = True
+            self.note_taker.start_recording()
             self.record_button.config(text="Stop Recording")
             self.status_label.config(text="Recording...")
             self.recording_thread = threading.Thread(target=self.record_loop)
             self.recording_thread.start()
         else:
             self.recording = False
+            self.note_taker.stop_recording()
             self.record_button.config(text="Start Recording")
             self.status_label.config(text="Recording stopped")
 
@@ -71,7 +125,7 @@ class NoteTakerGUI:
         
         self.status_label.config(text="Generating notes...")
         try:
-            self.note_taker.transcription_to_notes()
+            self.note_taker.generate_notes(wait=True)
             self.status_label.config(text="Notes generated successfully")
         except Exception as e:
             self.status_label.config(text=f"Error generating notes: {str(e)}")
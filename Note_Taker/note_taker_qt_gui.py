@@ -2,10 +2,24 @@ import sys
 import os
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                            QHBoxLayout, QLineEdit, QPushButton, QLabel, 
-                           QStatusBar, QProgressBar, QTextEdit, QFrame)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QTimer
+                           QStatusBar, QProgressBar, QTextEdit, QFrame, QListWidget,
+                           QListWidgetItem, QCheckBox)
+from PyQt6.QtCore import Qt, QThread, QObject, pyqtSignal, QTimer
+from PyQt6.QtGui import QTextCursor
 from note_taker import Note_Taker
+from utils.transcribe import warm_up_model, transcription_lag
+from utils.lazy import preload
+from utils import metrics
+from utils.log_sink import LogSink
+from utils.search_index import get_search_index
+from utils.embedding_index import get_embedding_index, EMBED_MODEL
+from utils.llm import get_client
+from utils.audio_archive import archive_available
 import threading
+import time
+
+# The lag panel turns red when transcription falls further behind than this
+LAG_WARNING_SECONDS = 30
 
 class RecordingThread(QThread):
     status_update = pyqtSignal(str)
@@ -25,13 +39,65 @@ class RecordingThread(QThread):
     def stop(self):
         self.is_running = False
 
+class NotesBridge(QObject):
+    """
+    Carries Note_Taker's notes changes from worker threads to the GUI thread
+    """
+    appended = pyqtSignal(str)
+    rewritten = pyqtSignal(str)
+
+    def notes_changed(self, kind, text):
+        if kind == "append":
+            self.appended.emit(text)
+        else:
+            self.rewritten.emit(text)
+
 class ModernNoteTakerGUI(QMainWindow):
+    # Emitted from the preload thread, with the error message or "" when everything loaded
+    models_loaded = pyqtSignal(str)
+
     def __init__(self):
         super().__init__()
         self.note_taker = None
+        self.models_ready = False
         self.compound_thread = None
         self.recording_thread = None
+        self.log_sink = LogSink(max_lines=1000)
+        self.notes_bridge = NotesBridge()
+        self.notes_bridge.appended.connect(self.append_notes_text)
+        self.notes_bridge.rewritten.connect(self.set_notes_text)
+        self.models_loaded.connect(self.on_models_loaded)
         self.init_ui()
+        # Counters and timings for every stage, for comparing machines after the fact
+        metrics.registry.start_writer("metrics.prom")
+        self.search_index = get_search_index()
+        # whisper, torch and ollama load once the window is up instead of before it appears
+        QTimer.singleShot(0, self.load_models)
+
+    def load_models(self):
+        self.status_bar.showMessage("Loading speech and language models...")
+        # Busy indicator until the models are in, recording can't start before that anyway
+        self.progress_bar.setRange(0, 0)
+        self.models_started = time.perf_counter()
+        # Load whisper while the user is still typing a lecture name
+        preload(then=lambda: warm_up_model(background=False),
+                done=lambda error: self.models_loaded.emit(str(error) if error else ""))
+        # Pick up notes written since the last run (or by the Tk app) without holding up the window
+        index_thread = threading.Thread(target=self.index_existing_notes)
+        index_thread.daemon = True  # Thread will exit when main program exits
+        index_thread.start()
+
+    def on_models_loaded(self, error):
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
+        self.models_ready = True
+        if error:
+            self.status_bar.showMessage(f"Error loading models: {error}")
+        else:
+            self.status_bar.showMessage("Models loaded, ready to record")
+        self.log_debug(f"Models loaded in {time.perf_counter() - self.models_started:.1f} seconds")
+        if self.note_taker is not None:
+            self.record_button.setEnabled(True)
 
     def init_ui(self):
         # Set window properties
@@ -99,6 +165,8 @@ class ModernNoteTakerGUI(QMainWindow):
         # Debug text area
         self.debug_display = QTextEdit()
         self.debug_display.setReadOnly(True)
+        # Qt drops the oldest lines itself once the console is full
+        self.debug_display.document().setMaximumBlockCount(self.log_sink.max_lines)
         self.debug_display.setStyleSheet("""
             QTextEdit {
                 background-color: #1e1e1e;
@@ -159,7 +227,13 @@ class ModernNoteTakerGUI(QMainWindow):
         
         self.create_button = QPushButton("Create")
         self.create_button.clicked.connect(self.create_note_taker)
+        # Keeps the lecture's audio (compressed) so it can be re-transcribed later
+        self.archive_checkbox = QCheckBox("Keep audio")
+        self.archive_checkbox.setEnabled(archive_available())
+        if not archive_available():
+            self.archive_checkbox.setToolTip("Needs the soundfile package")
         name_layout.addWidget(self.lecture_name_input)
+        name_layout.addWidget(self.archive_checkbox)
         name_layout.addWidget(self.create_button)
         main_layout.addLayout(name_layout)
 
@@ -198,6 +272,11 @@ class ModernNoteTakerGUI(QMainWindow):
         """)
         main_layout.addWidget(self.progress_bar)
 
+        # Live view of whether this machine keeps up with the lecture
+        self.lag_label = QLabel()
+        self.lag_label.setStyleSheet("font-size: 12px; color: #333333;")
+        main_layout.addWidget(self.lag_label)
+
         # Notes display area
         notes_frame = QFrame()
         notes_frame.setStyleSheet("""
@@ -232,10 +311,38 @@ class ModernNoteTakerGUI(QMainWindow):
         notes_layout.addWidget(self.notes_display)
         main_layout.addWidget(notes_frame)
 
-        # Setup notes update timer
-        self.notes_update_timer = QTimer()
-        self.notes_update_timer.timeout.connect(self.update_notes_display)
-        self.notes_update_timer.start(500)  # Update every 2 seconds
+        # Search across every lecture's notes and transcripts
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search all lectures...")
+        self.search_input.setStyleSheet("""
+            QLineEdit {
+                color: #000000;
+                background-color: #FFFFFF;
+            }
+        """)
+        self.search_input.textChanged.connect(lambda text: self.search_timer.start(250))
+        self.search_input.returnPressed.connect(self.run_search)
+        main_layout.addWidget(self.search_input)
+
+        self.search_results = QListWidget()
+        self.search_results.setMaximumHeight(150)
+        self.search_results.setWordWrap(True)
+        self.search_results.setStyleSheet("""
+            QListWidget {
+                border: 1px solid #BDBDBD;
+                border-radius: 4px;
+                background-color: white;
+                color: #333333;
+                font-size: 12px;
+            }
+        """)
+        self.search_results.hide()
+        main_layout.addWidget(self.search_results)
+
+        # Searches once typing pauses instead of on every key
+        self.search_timer = QTimer()
+        self.search_timer.setSingleShot(True)
+        self.search_timer.timeout.connect(self.run_search)
 
         # Status bar
         self.status_bar = QStatusBar()
@@ -249,6 +356,16 @@ class ModernNoteTakerGUI(QMainWindow):
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("Ready to start")
 
+        # Move queued console lines into the widget in batches on the GUI thread
+        self.log_timer = QTimer()
+        self.log_timer.timeout.connect(self.flush_debug_log)
+        self.log_timer.start(100)
+
+        self.metrics_timer = QTimer()
+        self.metrics_timer.timeout.connect(self.update_metrics_panel)
+        self.metrics_timer.start(1000)
+        self.update_metrics_panel()
+
         # Timer for progress bar
         self.progress_timer = QTimer()
         self.progress_timer.timeout.connect(self.update_progress)
@@ -271,6 +388,7 @@ class ModernNoteTakerGUI(QMainWindow):
         self.log_debug("Starting new recording session")
         
         # Start recording thread
+        self.note_taker.start_recording()
         self.recording_thread = RecordingThread(self.note_taker)
         self.recording_thread.status_update.connect(self.update_status)
         self.recording_thread.start()
@@ -288,6 +406,8 @@ class ModernNoteTakerGUI(QMainWindow):
         
         if self.recording_thread:
             self.recording_thread.stop()
+            # Stopping the device wakes the thread up instead of waiting out the segment
+            self.note_taker.stop_recording()
             self.recording_thread.wait()
             self.log_debug("Recording thread stopped")
             
@@ -301,10 +421,9 @@ class ModernNoteTakerGUI(QMainWindow):
         
         self.status_bar.showMessage("Generating notes...")
         try:
-            notes_thread = threading.Thread(target=self.note_taker.transcription_to_notes)
-            notes_thread.daemon = True  # Thread will exit when main program exits
-            notes_thread.start()
-            self.status_bar.showMessage("Notes generated successfully")
+            # Runs on the lecture's scheduler thread right after any generation already going
+            self.note_taker.generate_notes()
+            self.status_bar.showMessage("Notes generation started")
         except Exception as e:
             self.status_bar.showMessage(f"Error generating notes: {str(e)}")
 
@@ -316,28 +435,106 @@ class ModernNoteTakerGUI(QMainWindow):
         self.progress_bar.setValue(self.progress_value)
         
     def log_debug(self, message):
-        """Add a timestamped message to the debug console"""
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-        debug_message = f"[{timestamp}] {message}\n"
-        self.debug_display.append(debug_message)
+        """Add a timestamped message to the debug console, safe to call from any thread"""
+        self.log_sink.log(message)
+
+    def flush_debug_log(self):
+        lines = self.log_sink.drain()
+        if not lines:
+            return
+        self.debug_display.append("\n".join(lines))
         # Auto-scroll to bottom
         self.debug_display.verticalScrollBar().setValue(
             self.debug_display.verticalScrollBar().maximum()
         )
 
+    def update_metrics_panel(self):
+        lag = transcription_lag()
+        if lag >= 1:
+            text = f"Transcription is {lag:.0f} seconds behind real time"
+        else:
+            text = "Transcription is keeping up with real time"
+        details = []
+        rtf = metrics.registry.get("note_taker_whisper_rtf")
+        if rtf is not None and rtf.mean() is not None:
+            details.append(f"whisper RTF {rtf.mean():.2f}")
+        ttft = metrics.registry.get("note_taker_llm_ttft_seconds")
+        if ttft is not None and ttft.mean() is not None:
+            details.append(f"LLM first token {ttft.mean():.1f}s")
+        # Audio lost before it reached the transcript, should stay at 0
+        overflows = metrics.registry.get("note_taker_audio_input_overflows")
+        if overflows is not None and overflows.get() > 0:
+            details.append(f"{overflows.get():.0f} input overruns")
+        dropped = metrics.registry.get("note_taker_audio_dropped_frames")
+        if dropped is not None and dropped.get() > 0:
+            details.append(f"{dropped.get():.0f} frames dropped")
+        if details:
+            text += " (" + ", ".join(details) + ")"
+        self.lag_label.setText(text)
+        color = "#C62828" if lag > LAG_WARNING_SECONDS else "#333333"
+        self.lag_label.setStyleSheet(f"font-size: 12px; color: {color};")
+
+    def index_existing_notes(self):
+        try:
+            changed = self.search_index.index_directory(".")
+            self.log_debug(f"Search index up to date ({changed} sections updated)")
+        except Exception as e:
+            self.log_debug(f"Error indexing notes: {str(e)}")
+        try:
+            # Earlier lectures' notes become related context for new ones
+            llm = get_client()
+            changed = get_embedding_index().index_directory(lambda texts: llm.embed(EMBED_MODEL, texts), ".")
+            self.log_debug(f"Embeddings up to date ({changed} sections embedded)")
+        except Exception as e:
+            self.log_debug(f"Error embedding notes: {str(e)}")
+
+    def run_search(self):
+        query = self.search_input.text().strip()
+        self.search_results.clear()
+        if not query:
+            self.search_results.hide()
+            return
+        try:
+            results = self.search_index.search(query, limit=50)
+        except Exception as e:
+            self.status_bar.showMessage(f"Search failed: {str(e)}")
+            return
+        for result in results:
+            where = "notes" if result["kind"] == "notes" else "transcript"
+            item = QListWidgetItem(f"{result['lecture']} ({where}): {result['snippet'].strip()}")
+            item.setToolTip(result["text"][:1000])
+            self.search_results.addItem(item)
+        if not results:
+            self.search_results.addItem("No matches")
+        self.search_results.show()
+
     def update_notes_display(self):
+        """
+        Loads the whole notes file, only needed once when a note taker is created,
+        after that Note_Taker pushes its changes through notes_bridge
+        """
         if self.note_taker and hasattr(self.note_taker, 'note_name'):
             try:
                 if os.path.exists(self.note_taker.note_name):
                     with open(self.note_taker.note_name, 'r') as f:
-                        current_notes = f.read()
-                        if current_notes != self.notes_display.toPlainText():
-                            self.notes_display.setPlainText(current_notes)
+                        self.set_notes_text(f.read())
             except Exception as e:
                 self.log_debug(f"Error reading notes: {str(e)}")
                 self.status_bar.showMessage(f"Error reading notes: {str(e)}")
                 
+    def append_notes_text(self, text):
+        # Insert only the new text at the end instead of re-laying out the whole document
+        scrollbar = self.notes_display.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+        cursor = QTextCursor(self.notes_display.document())
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertText(text)
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
+
+    def set_notes_text(self, text):
+        self.notes_display.setPlainText(text)
+
     def start_compound_notes(self):
         if not self.note_taker:
             self.status_bar.showMessage("Create a note taker first")
@@ -366,12 +563,19 @@ class ModernNoteTakerGUI(QMainWindow):
     def create_note_taker(self):
         name = self.lecture_name_input.text().strip()
         if name:
-            self.note_taker = Note_Taker(name, self.log_debug)
-            self.record_button.setEnabled(True)
+            self.note_taker = Note_Taker(name, self.log_debug, archive_audio=self.archive_checkbox.isChecked(),
+                                         archive_format="opus")
+            self.note_taker.add_notes_listener(self.notes_bridge.notes_changed)
+            # Recording waits for whisper, notes of earlier recordings don't
+            self.record_button.setEnabled(self.models_ready)
             self.generate_button.setEnabled(True)
             self.compound_button.setEnabled(True)
-            self.status_bar.showMessage("Note taker created successfully")
+            if self.models_ready:
+                self.status_bar.showMessage("Note taker created successfully")
+            else:
+                self.status_bar.showMessage("Note taker created, models are still loading...")
             self.lecture_name_input.setEnabled(False)
+            self.archive_checkbox.setEnabled(False)
             self.create_button.setEnabled(False)
             
             self.log_debug(f"Created new Note Taker for lecture: {name}")
@@ -0,0 +1,101 @@
+"""
+Import-time benchmark for app start, to catch a heavy import sneaking back onto the startup path.
+
+    python startup_benchmark.py --runs 5 --out startup.json
+    python startup_benchmark.py --max-seconds 0.5     # exits with 1 if slower, for CI
+
+Each run imports the GUI modules in a fresh interpreter with `python -X importtime` and reports
+the total import time, the slowest modules (cumulative, like the importtime tree) and whether
+any of the modules that should load lazily (whisper, torch, ollama, scipy.signal, ...) were
+imported anyway. Nothing is imported into this process, so the numbers are a cold start's.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from statistics import median
+from utils.lazy import HEAVY_MODULES
+
+# What the windows import before they appear, the GUI toolkits themselves are left out
+# so the benchmark runs on machines without a display or PyQt
+STARTUP_MODULES = ("note_taker", "note_service")
+# Should only be imported by utils.lazy.preload after the window is up
+LAZY_MODULES = HEAVY_MODULES + ("torch", "scipy.stats")
+
+def parse_importtime(stderr):
+    """
+    Parses -X importtime output into (module, self_us, cumulative_us, depth) rows
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+def import_once(modules):
+    code = "import " + ", ".join(modules)
+    here = os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=here,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows = parse_importtime(result.stderr)
+    # The startup modules are top level entries, the rest of the tree is counted inside them
+    total = sum(cumulative for name, _, cumulative, depth in rows if depth == 0 and name in modules)
+    return {"wall_seconds": wall, "import_seconds": total / 1e6, "rows": rows}
+
+def run_startup_benchmark(modules=STARTUP_MODULES, runs=5, top=15):
+    # The first run warms the OS file cache and writes .pyc files, it isn't counted
+    import_once(modules)
+    results = [import_once(modules) for _ in range(runs)]
+    last = results[-1]["rows"]
+    loaded = {name for name, _, _, _ in last}
+    slowest = sorted(last, key=lambda row: row[2], reverse=True)[:top]
+    return {
+        "modules": list(modules),
+        "runs": runs,
+        "import_seconds": median(result["import_seconds"] for result in results),
+        "wall_seconds": median(result["wall_seconds"] for result in results),
+        "slowest": [{"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+                    for name, self_us, cumulative_us, _ in slowest],
+        "eager_heavy_imports": sorted(name for name in LAZY_MODULES if name in loaded),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how long the app's modules take to import")
+    parser.add_argument("--module", action="append", default=None,
+                        help="module to import, can be given more than once (default note_taker and note_service)")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to time, the median is reported")
+    parser.add_argument("--top", type=int, default=15, help="how many of the slowest modules to list")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="fail if importing takes longer than this or a lazy module is imported eagerly")
+    parser.add_argument("--out", default=None, help="also write the results here as JSON")
+    args = parser.parse_args()
+
+    result = run_startup_benchmark(tuple(args.module or STARTUP_MODULES), args.runs, args.top)
+    print(f"import {', '.join(result['modules'])}: {result['import_seconds'] * 1000:.0f} ms "
+          f"(interpreter start included {result['wall_seconds'] * 1000:.0f} ms, median of {result['runs']})")
+    for row in result["slowest"]:
+        print(f"  {row['cumulative_ms']:8.1f} ms  {row['module']}")
+    if result["eager_heavy_imports"]:
+        print(f"Imported at startup but should be lazy: {', '.join(result['eager_heavy_imports'])}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), **result}, f, indent=2)
+        print(f"Results written to {args.out}")
+
+    if args.max_seconds is not None:
+        if result["import_seconds"] > args.max_seconds or result["eager_heavy_imports"]:
+            print(f"Startup is over budget ({args.max_seconds:g} seconds, no eager heavy imports)")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import importlib.util
+import io
+import json
+import mmap
+import os
+import threading
+import time
+import numpy as np
+from utils.lazy import lazy_import
+from utils.record import WHISPER_FREQ
+
+# Optional, only needed when a lecture's audio is archived
+soundfile = lazy_import("soundfile")
+
+# soundfile format and subtype for each archive format. Opus is several times smaller than FLAC
+# and fine for re-transcribing, FLAC keeps the audio exactly as whisper got it (at 16 bits)
+FORMATS = {"flac": ("FLAC", "PCM_16"), "opus": ("OGG", "OPUS")}
+# One row per chunk in the order they were written: when its first sample was captured (epoch
+# seconds), how many samples it has and where its encoded bytes are in the data file
+INDEX_DTYPE = np.dtype([("time", "<f8"), ("samples", "<i8"), ("offset", "<i8"), ("length", "<i8")])
+# Audio that starts less than this long after the last block ended continues the same chunk,
+# a bigger gap (recording was stopped) starts a new one at its own time. Chunk times only go up
+CONTIGUOUS_SECONDS = 1.0
+
+def archive_available():
+    return importlib.util.find_spec("soundfile") is not None
+
+
+class AudioArchive:
+    """
+    A lecture's captured audio, kept for re-transcribing later with a better model. Audio is
+    archived as whisper gets it (16 kHz mono) in chunks of chunk_seconds, each one a complete FLAC
+    or Ogg Opus file appended to chunks.dat. index.bin has a fixed-size row per chunk, so finding
+    the chunks around a timestamp is a binary search, and reads decode just those chunks straight
+    out of a memory map of chunks.dat. Chunks are written before their index rows, so a crash
+    loses at most the chunk being written. readonly=True opens an archive that may still be
+    recorded to without touching it, reads see the chunks written up to then
+    """
+
+    def __init__(self, directory, audio_format="flac", chunk_seconds=30, freq=WHISPER_FREQ, readonly=False):
+        if not archive_available():
+            raise RuntimeError("Archiving audio needs the soundfile package (pip install soundfile)")
+        self.directory = directory
+        self.data_path = os.path.join(directory, "chunks.dat")
+        self.index_path = os.path.join(directory, "index.bin")
+        self.info_path = os.path.join(directory, "info.json")
+        self.readonly = readonly
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+        # An existing archive keeps the format it was started with
+        if os.path.exists(self.info_path):
+            with open(self.info_path, "r") as f:
+                info = json.load(f)
+            audio_format, freq = info["format"], info["freq"]
+        elif readonly:
+            raise FileNotFoundError(f"No audio archive in {directory}")
+        else:
+            if audio_format not in FORMATS:
+                raise ValueError(f"Unknown archive format {audio_format}, expected one of {', '.join(FORMATS)}")
+            with open(self.info_path, "w") as f:
+                json.dump({"format": audio_format, "freq": freq}, f)
+        self.audio_format = audio_format
+        self.freq = freq
+        self.chunk_samples = int(chunk_seconds * freq)
+        self.lock = threading.Lock()
+        self.index = self.recover()
+        self.data_size = int(self.index["offset"][-1] + self.index["length"][-1]) if len(self.index) else 0
+        self.data_file = None if readonly else open(self.data_path, "ab")
+        self.index_file = None if readonly else open(self.index_path, "ab")
+        self.mapped = None
+        # Captured audio not written to a chunk yet
+        self.pending = []
+        self.pending_samples = 0
+        self.pending_time = None
+        self.end_time = None
+
+    def recover(self):
+        """
+        Loads the index, dropping rows a crash left half written or pointing past the data
+        """
+        if not os.path.exists(self.index_path):
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        with open(self.index_path, "rb") as f:
+            raw = f.read()
+        index = np.frombuffer(raw[:len(raw) - len(raw) % INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE).copy()
+        index = index[index["offset"] + index["length"] <= data_size]
+        end = int(index["offset"][-1] + index["length"][-1]) if len(index) else 0
+        if self.readonly:
+            # The writer may be halfway through a chunk, that isn't damage
+            return index
+        if len(index) * INDEX_DTYPE.itemsize != len(raw):
+            with open(self.index_path, "wb") as f:
+                f.write(index.tobytes())
+        if end != data_size:
+            # Bytes of a chunk whose index row never made it
+            with open(self.data_path, "r+b") as f:
+                f.truncate(end)
+        return index
+
+    def append(self, audio, captured_at=None):
+        """
+        Adds captured audio (float32 at self.freq), captured_at is when its first sample was
+        recorded and defaults to the audio having just ended
+        """
+        if self.readonly:
+            raise ValueError("Archive was opened read-only")
+        audio = np.asarray(audio, dtype=np.float32).reshape(-1)
+        if not len(audio):
+            return
+        seconds = len(audio) / self.freq
+        start = captured_at if captured_at is not None else time.time() - seconds
+        with self.lock:
+            if self.end_time is not None and start - self.end_time <= CONTIGUOUS_SECONDS:
+                # Timed by sample count within a run of audio, wall clock reads would drift
+                # (or run ahead of the audio when a backlog is read all at once)
+                start = self.end_time
+            elif self.pending:
+                self.write_pending()
+            if not self.pending:
+                self.pending_time = start
+            self.pending.append(audio)
+            self.pending_samples += len(audio)
+            self.end_time = start + seconds
+            while self.pending_samples >= self.chunk_samples:
+                buffer = np.concatenate(self.pending)
+                self.write_chunk(buffer[:self.chunk_samples], self.pending_time)
+                rest = buffer[self.chunk_samples:]
+                self.pending = [rest] if len(rest) else []
+                self.pending_samples = len(rest)
+                self.pending_time += self.chunk_samples / self.freq
+
+    def write_pending(self):
+        if self.pending:
+            self.write_chunk(np.concatenate(self.pending), self.pending_time)
+        self.pending = []
+        self.pending_samples = 0
+
+    def write_chunk(self, audio, chunk_time):
+        audio_format, subtype = FORMATS[self.audio_format]
+        encoded = io.BytesIO()
+        soundfile.write(encoded, audio, self.freq, format=audio_format, subtype=subtype)
+        data = encoded.getvalue()
+        row = np.array([(chunk_time, len(audio), self.data_size, len(data))], dtype=INDEX_DTYPE)
+        # The chunk is on disk before the index row that points at it
+        self.data_file.write(data)
+        self.data_file.flush()
+        self.index_file.write(row.tobytes())
+        self.index_file.flush()
+        self.data_size += len(data)
+        self.index = np.concatenate((self.index, row))
+
+    def flush(self):
+        """
+        Writes the audio that hasn't filled a chunk yet, after this it can be read
+        """
+        with self.lock:
+            self.write_pending()
+            self.end_time = None
+
+    def start_time(self):
+        return float(self.index["time"][0]) if len(self.index) else None
+
+    def duration(self):
+        """
+        Seconds from the first archived sample to the last, gaps included
+        """
+        if not len(self.index):
+            return 0.0
+        ends = self.index["time"] + self.index["samples"] / self.freq
+        return float(ends.max() - self.index["time"][0])
+
+    def size(self):
+        return self.data_size
+
+    def map_data(self):
+        # Mapped again once chunks were appended past the end of the current map
+        if self.mapped is None or len(self.mapped) < self.data_size:
+            if self.mapped is not None:
+                self.mapped.close()
+            with open(self.data_path, "rb") as f:
+                self.mapped = mmap.mmap(f.fileno(), self.data_size, access=mmap.ACCESS_READ)
+        return self.mapped
+
+    def decode(self, row):
+        offset, length = int(row["offset"]), int(row["length"])
+        audio, _ = soundfile.read(io.BytesIO(self.map_data()[offset:offset + length]), dtype="float32")
+        # Lossy codecs can come back a few samples off, the index has the real length
+        samples = int(row["samples"])
+        if len(audio) >= samples:
+            return audio[:samples]
+        return np.pad(audio, (0, samples - len(audio)))
+
+    def overlapping(self, start, end):
+        """
+        Index rows of the chunks that overlap [start, end), in seconds from the start of the archive
+        """
+        if not len(self.index):
+            return self.index
+        first = self.index["time"][0]
+        # Chunk times only go up, so the candidates are found by binary search
+        last = np.searchsorted(self.index["time"], first + end, side="left")
+        rows = self.index[:last]
+        return rows[rows["time"] + rows["samples"] / self.freq > first + start]
+
+    def read(self, start=0.0, seconds=None):
+        """
+        The archived audio from `start` seconds into the lecture, `seconds` long or to the end.
+        Times that weren't recorded (recording was stopped) come back as silence
+        """
+        with self.lock:
+            if not len(self.index):
+                return np.zeros(0, dtype=np.float32)
+            if seconds is None:
+                seconds = max(0.0, self.duration() - start)
+            total = int(round(seconds * self.freq))
+            out = np.zeros(total, dtype=np.float32)
+            first = self.index["time"][0]
+            for row in self.overlapping(start, start + seconds):
+                audio = self.decode(row)
+                at = int(round((row["time"] - first - start) * self.freq))
+                lo, hi = max(0, -at), min(len(audio), total - at)
+                if hi > lo:
+                    out[at + lo:at + hi] = audio[lo:hi]
+            return out
+
+    def chunks(self, start=0.0, end=None):
+        """
+        Yields (seconds into the lecture, audio) for every chunk from `start` on, for re-transcribing
+        chunk by chunk instead of decoding the whole lecture at once
+        """
+        with self.lock:
+            rows = self.overlapping(start, end if end is not None else float("inf"))
+            first = self.index["time"][0] if len(self.index) else 0.0
+        for row in rows:
+            with self.lock:
+                audio = self.decode(row)
+            yield float(row["time"] - first), audio
+
+    def close(self):
+        with self.lock:
+            if not self.readonly:
+                self.write_pending()
+                self.end_time = None
+                self.data_file.close()
+                self.index_file.close()
+            if self.mapped is not None:
+                self.mapped.close()
+                self.mapped = None
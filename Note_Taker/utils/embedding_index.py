@@ -0,0 +1,266 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import numpy as np
+from numpy.lib.format import open_memmap
+from utils.note_context import split_sections
+
+EMBED_MODEL = "nomic-embed-text"
+# .txt files in the notes directory that aren't a lecture's notes
+NOT_NOTES = {"transcription.txt"}
+# meta.jsonl is rewritten with just the live rows once it has this many more lines than them
+COMPACT_SLACK = 1000
+
+def course_name(lecture):
+    """
+    The course a lecture belongs to going by its name, "Calculus 3" and "Calculus - Lecture 12"
+    are both Calculus. A name without a number is its own course
+    """
+    course = re.sub(r"[\s_-]*((lecture|lec|week|day|class|part)[\s_-]*)?\d[\d\s._/-]*$", "", lecture, flags=re.IGNORECASE)
+    return course.strip() or lecture
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class EmbeddingIndex:
+    """
+    Embeddings of every lecture's note sections, for finding related notes from earlier lectures.
+    Vectors are rows of a memory-mapped .npy matrix, normalized so cosine similarity is a dot
+    product, and searched in blocks so only the pages being scored are read. Metadata goes in an
+    append-only JSON lines file that is replayed on open and compacted once it's mostly replaced
+    records. A changed section overwrites its own row, removed sections free theirs for reuse, and
+    the matrix doubles in size when it fills up
+    """
+
+    def __init__(self, directory="embeddings", initial_rows=1024):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "vectors.npy")
+        self.meta_path = os.path.join(directory, "meta.jsonl")
+        self.initial_rows = initial_rows
+        self.lock = threading.Lock()
+        # Metadata per row, None for free rows
+        self.entries = []
+        self.free = []
+        self.rows = {}
+        # Course and lecture of every row as ids so a search can mask rows without a Python loop
+        self.course_ids = {}
+        self.lecture_ids = {}
+        self.row_course = np.zeros(0, dtype=np.int32)
+        self.row_lecture = np.zeros(0, dtype=np.int32)
+        self.vectors = None
+        # Lines in meta.jsonl, live rows and the records they replaced
+        self.meta_lines = 0
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.vectors_path):
+            self.vectors = open_memmap(self.vectors_path, mode="r+")
+            self.resize_ids(len(self.vectors))
+            self.load_meta()
+
+    def load_meta(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            for line in f:
+                self.meta_lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A write cut short by a crash, the rows before it are still good
+                    continue
+                if record.get("deleted"):
+                    self.set_entry(record["row"], None)
+                else:
+                    self.set_entry(record["row"], record)
+        self.free = [row for row, entry in enumerate(self.entries) if entry is None]
+        if self.meta_lines > len(self.rows) + COMPACT_SLACK:
+            self.compact_meta()
+
+    def compact_meta(self):
+        """
+        Rewrites meta.jsonl with one record per live row, replacing the file in one step so a
+        crash leaves either the old or the new one
+        """
+        temp_path = self.meta_path + ".tmp"
+        live = [entry for entry in self.entries if entry is not None]
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in live))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.meta_path)
+        self.meta_lines = len(live)
+
+    def resize_ids(self, capacity):
+        for name in ("row_course", "row_lecture"):
+            old = getattr(self, name)
+            ids = np.full(capacity, -1, dtype=np.int32)
+            ids[:len(old)] = old[:capacity]
+            setattr(self, name, ids)
+
+    def set_entry(self, row, entry):
+        while len(self.entries) <= row:
+            self.entries.append(None)
+        old = self.entries[row]
+        if old is not None:
+            self.rows.pop((old["lecture"], old["position"]), None)
+        self.entries[row] = entry
+        if entry is None:
+            self.row_course[row] = -1
+            self.row_lecture[row] = -1
+            return
+        self.rows[(entry["lecture"], entry["position"])] = row
+        self.row_course[row] = self.course_ids.setdefault(entry["course"], len(self.course_ids))
+        self.row_lecture[row] = self.lecture_ids.setdefault(entry["lecture"], len(self.lecture_ids))
+
+    def allocate(self, dim):
+        if self.free:
+            return self.free.pop()
+        if self.vectors is None:
+            self.vectors = open_memmap(self.vectors_path, mode="w+", dtype=np.float32, shape=(self.initial_rows, dim))
+            self.resize_ids(self.initial_rows)
+        elif len(self.entries) >= len(self.vectors):
+            self.grow()
+        row = len(self.entries)
+        self.entries.append(None)
+        return row
+
+    def grow(self):
+        capacity = len(self.vectors) * 2
+        temp_path = self.vectors_path + ".tmp.npy"
+        grown = open_memmap(temp_path, mode="w+", dtype=np.float32, shape=(capacity, self.vectors.shape[1]))
+        grown[:len(self.vectors)] = self.vectors
+        grown.flush()
+        del grown
+        # The old map has to be closed before its file can be replaced on Windows
+        self.vectors.flush()
+        self.vectors = None
+        os.replace(temp_path, self.vectors_path)
+        self.vectors = open_memmap(self.vectors_path, mode="r+")
+        self.resize_ids(capacity)
+
+    def has_candidates(self, course, exclude_lecture=None):
+        """
+        True if there's anything a search for this course would return
+        """
+        with self.lock:
+            course_id = self.course_ids.get(course)
+            if course_id is None:
+                return False
+            mask = self.row_course == course_id
+            if exclude_lecture in self.lecture_ids:
+                mask &= self.row_lecture != self.lecture_ids[exclude_lecture]
+            return bool(mask.any())
+
+    def update_sections(self, lecture, course, sections, embed):
+        """
+        Embeds the lecture's sections that are new or changed since the last update, embed(texts)
+        returns one vector per text. Returns how many sections were embedded
+        """
+        hashes = [hashlib.sha1(section.encode("utf-8")).hexdigest() for section in sections]
+        with self.lock:
+            todo = []
+            for position, (section, section_hash) in enumerate(zip(sections, hashes)):
+                row = self.rows.get((lecture, position))
+                if row is None or self.entries[row]["hash"] != section_hash or self.entries[row]["course"] != course:
+                    todo.append(position)
+
+        # The embedding request is the slow part, it runs without holding the lock
+        vectors = normalize(embed([sections[position] for position in todo])) if todo else None
+
+        with self.lock:
+            records = []
+            # Looked up again now, another update may have removed them while this one was embedding
+            removed = [row for (name, position), row in self.rows.items() if name == lecture and position >= len(sections)]
+            for row in removed:
+                self.set_entry(row, None)
+                self.free.append(row)
+                records.append({"row": row, "deleted": True})
+            for index, position in enumerate(todo):
+                row = self.rows.get((lecture, position))
+                if row is None:
+                    row = self.allocate(vectors.shape[1])
+                self.vectors[row] = vectors[index]
+                entry = {"row": row, "lecture": lecture, "course": course, "position": position,
+                         "hash": hashes[position], "text": sections[position]}
+                self.set_entry(row, entry)
+                records.append(entry)
+            if not records:
+                return 0
+            # Vectors are on disk before the metadata that points at them
+            self.vectors.flush()
+            with open(self.meta_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+            self.meta_lines += len(records)
+            if self.meta_lines > len(self.rows) + COMPACT_SLACK:
+                self.compact_meta()
+        return len(todo)
+
+    def search(self, queries, k=3, course=None, exclude_lecture=None, min_score=0.0, block_rows=65536):
+        """
+        The k best matching sections for each query vector, as lists of (score, entry) best first.
+        Only sections from `course` are considered (all when None), minus those of exclude_lecture
+        """
+        queries = normalize(np.atleast_2d(queries))
+        results = [[] for _ in range(len(queries))]
+        with self.lock:
+            count = len(self.entries)
+            if self.vectors is None or count == 0:
+                return results
+            mask = self.row_course[:count] >= 0
+            if course is not None:
+                mask &= self.row_course[:count] == self.course_ids.get(course, -2)
+            if exclude_lecture in self.lecture_ids:
+                mask &= self.row_lecture[:count] != self.lecture_ids[exclude_lecture]
+
+            best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+            best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+            for start in range(0, count, block_rows):
+                end = min(start + block_rows, count)
+                block_mask = mask[start:end]
+                if not block_mask.any():
+                    continue
+                scores = queries @ np.asarray(self.vectors[start:end]).T
+                scores[:, ~block_mask] = -np.inf
+                # Merge this block's scores with the best so far and keep the top k
+                scores = np.concatenate((best_scores, scores), axis=1)
+                rows = np.concatenate((best_rows, np.broadcast_to(np.arange(start, end), (len(queries), end - start))), axis=1)
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(scores, top, axis=1)
+                best_rows = np.take_along_axis(rows, top, axis=1)
+
+            for index in range(len(queries)):
+                for column in np.argsort(-best_scores[index]):
+                    score, row = float(best_scores[index, column]), int(best_rows[index, column])
+                    if row >= 0 and score > min_score and self.entries[row] is not None:
+                        results[index].append((score, self.entries[row]))
+        return results
+
+    def index_directory(self, embed, directory="."):
+        """
+        Embeds any new or changed sections of every notes file in the directory
+        """
+        changed = 0
+        for path in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+            if os.path.basename(path) in NOT_NOTES:
+                continue
+            lecture = os.path.splitext(os.path.basename(path))[0]
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                notes = f.read()
+            changed += self.update_sections(lecture, course_name(lecture), split_sections(notes), embed)
+        return changed
+
+# Shared by every Note_Taker in the process and the GUI
+default_index = None
+default_index_lock = threading.Lock()
+
+def get_embedding_index():
+    global default_index
+    with default_index_lock:
+        if default_index is None:
+            default_index = EmbeddingIndex()
+    return default_index
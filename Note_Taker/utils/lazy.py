@@ -0,0 +1,80 @@
+import importlib
+import threading
+import time
+
+# The imports that make the windows slow to appear: whisper pulls in torch, scipy.signal pulls in
+# most of scipy. preload() brings them in on a background thread once the window is up
+HEAVY_MODULES = ("whisper", "ollama", "scipy.signal", "sounddevice")
+
+class LazyModule:
+    """
+    Stands in for a module until one of its attributes is used, then imports it. Lets a module
+    keep `whisper.load_model(...)` style calls while deferring the import itself:
+
+        whisper = lazy_import("whisper")
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            with self.__dict__["_lock"]:
+                module = self.__dict__["_module"]
+                if module is None:
+                    module = importlib.import_module(self.__dict__["_name"])
+                    self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+# One proxy per module name, so preload() and every user share the same import
+lazy_modules = {}
+lazy_modules_lock = threading.Lock()
+
+def lazy_import(name):
+    with lazy_modules_lock:
+        module = lazy_modules.get(name)
+        if module is None:
+            module = lazy_modules[name] = LazyModule(name)
+    return module
+
+def preload(names=HEAVY_MODULES, then=None, done=None):
+    """
+    Imports `names` one by one on a background thread, then calls then() (loading model
+    weights for example). done(error) is called at the end, error is None if everything loaded.
+    The GUI passes a done that hands the result back to its own thread
+    """
+    def run():
+        error = None
+        for name in names:
+            start = time.perf_counter()
+            try:
+                lazy_import(name)._load()
+                print(f"Loaded {name} in {time.perf_counter() - start:.2f} seconds")
+            except Exception as e:
+                print(f"Error loading {name}: {str(e)}")
+                error = error or e
+        if then is not None:
+            try:
+                then()
+            except Exception as e:
+                print(f"Error warming up: {str(e)}")
+                error = error or e
+        if done is not None:
+            done(error)
+    thread = threading.Thread(target=run, name="preload")
+    thread.daemon = True  # Thread will exit when main program exits
+    thread.start()
+    return thread
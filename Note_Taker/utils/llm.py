@@ -0,0 +1,184 @@
+import threading
+import time
+from collections import deque
+from utils import metrics
+from utils.lazy import lazy_import
+
+ollama = lazy_import("ollama")
+
+# How long Ollama keeps the model in memory after the last request
+KEEP_ALIVE = "30m"
+
+REQUESTS = metrics.counter("note_taker_llm_requests_total", "LLM requests finished")
+REJECTED = metrics.counter("note_taker_llm_rejected_total", "LLM requests turned away because the queue was full")
+TOKENS = metrics.counter("note_taker_llm_tokens_total", "Tokens generated by the LLM")
+PROMPT_CHARS = metrics.histogram("note_taker_llm_prompt_chars", "Characters sent to the LLM per request",
+                                 (500, 1000, 2000, 4000, 8000, 16000, 32000, 64000))
+TTFT = metrics.histogram("note_taker_llm_ttft_seconds", "LLM time to first token")
+TOKENS_PER_SECOND = metrics.histogram("note_taker_llm_tokens_per_second", "LLM generation speed",
+                                      (1, 2, 5, 10, 20, 30, 50, 75, 100, 200))
+REQUEST_SECONDS = metrics.histogram("note_taker_llm_request_seconds", "Total time of one LLM request")
+EMBED_SECONDS = metrics.histogram("note_taker_llm_embed_seconds", "Time of one embedding request")
+
+class LLMBusyError(RuntimeError):
+    """
+    Raised when the request queue is full and the caller didn't want to wait
+    """
+
+
+class LLMClient:
+    """
+    The one way this app talks to Ollama. Wraps a single ollama.Client so every request reuses
+    the same keep-alive HTTP connection pool, keeps the model loaded with keep_alive, and puts
+    requests through a bounded queue: at most max_concurrent run at once and at most max_pending
+    wait behind them. Time to first token and tokens per second are kept for recent requests
+    """
+
+    def __init__(self, host=None, max_concurrent=2, max_pending=4, keep_alive=KEEP_ALIVE, timeout=None):
+        self.host = host
+        self.timeout = timeout
+        # Made on the first request, so a Note_Taker can be created before ollama is imported
+        self.ollama_client = None
+        self.client_lock = threading.Lock()
+        self.keep_alive = keep_alive
+        self.queue_slots = threading.Semaphore(max_concurrent + max_pending)
+        self.run_slots = threading.Semaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.running = 0
+        self.stats = deque(maxlen=100)
+
+    @property
+    def client(self):
+        if self.ollama_client is None:
+            with self.client_lock:
+                if self.ollama_client is None:
+                    self.ollama_client = ollama.Client(host=self.host, timeout=self.timeout)
+        return self.ollama_client
+
+    def preload(self, model):
+        """
+        Loads the model into memory so the first real request doesn't pay for it
+        """
+        self.client.generate(model=model, prompt="", keep_alive=self.keep_alive)
+
+    def preload_in_background(self, model):
+        def run():
+            try:
+                self.preload(model)
+            except Exception as e:
+                print(f"Error preloading {model}: {str(e)}")
+        thread = threading.Thread(target=run)
+        thread.daemon = True  # Thread will exit when main program exits
+        thread.start()
+        return thread
+
+    def busy(self):
+        """
+        True while any request is running or waiting
+        """
+        with self.lock:
+            return self.running + self.waiting > 0
+
+    def chat(self, model, messages, timeout=None, **kwargs):
+        """
+        Streams a chat response as content strings. Waits up to `timeout` seconds for room in the
+        queue (None waits as long as it takes, 0 not at all) and raises LLMBusyError if there isn't any
+        """
+        if not self.queue_slots.acquire(timeout=timeout):
+            REJECTED.inc()
+            raise LLMBusyError("Too many LLM requests waiting")
+        try:
+            with self.lock:
+                self.waiting += 1
+            self.run_slots.acquire()
+            with self.lock:
+                self.waiting -= 1
+                self.running += 1
+            try:
+                yield from self.stream(model, messages, **kwargs)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                self.run_slots.release()
+        finally:
+            self.queue_slots.release()
+
+    def stream(self, model, messages, **kwargs):
+        start = time.time()
+        first_token = None
+        chunks = 0
+        final = None
+        for chunk in self.client.chat(model=model, messages=messages, stream=True,
+                                      keep_alive=self.keep_alive, **kwargs):
+            content = chunk['message']['content']
+            if content:
+                if first_token is None:
+                    first_token = time.time()
+                chunks += 1
+            if chunk.get('done'):
+                final = chunk
+            yield content
+        self.record(model, messages, start, first_token, chunks, final)
+
+    def embed(self, model, texts):
+        """
+        One embedding vector per text, in a single request. Embeddings are quick so they don't
+        wait in the chat queue behind a long generation
+        """
+        with EMBED_SECONDS.time():
+            return self.client.embed(model=model, input=list(texts), keep_alive=self.keep_alive)['embeddings']
+
+    def record(self, model, messages, start, first_token, chunks, final):
+        end = time.time()
+        tokens = chunks
+        generation_seconds = end - (first_token or end)
+        if final is not None and final.get('eval_count'):
+            # Ollama's own count and timing are more accurate than counting chunks
+            tokens = final['eval_count']
+            generation_seconds = (final.get('eval_duration') or 0) / 1e9 or generation_seconds
+        entry = {
+            "model": model,
+            "prompt_chars": sum(len(message.get('content', '')) for message in messages),
+            "ttft": (first_token - start) if first_token else None,
+            "seconds": end - start,
+            "tokens": tokens,
+            "tokens_per_second": tokens / generation_seconds if generation_seconds > 0 else None,
+        }
+        with self.lock:
+            self.stats.append(entry)
+        REQUESTS.inc()
+        TOKENS.inc(tokens)
+        PROMPT_CHARS.observe(entry["prompt_chars"])
+        REQUEST_SECONDS.observe(entry["seconds"])
+        if entry["ttft"] is not None:
+            TTFT.observe(entry["ttft"])
+        if entry["tokens_per_second"]:
+            TOKENS_PER_SECOND.observe(entry["tokens_per_second"])
+        return entry
+
+    def summary(self):
+        """
+        Averages over the recent requests
+        """
+        with self.lock:
+            stats = list(self.stats)
+        ttfts = [s["ttft"] for s in stats if s["ttft"] is not None]
+        speeds = [s["tokens_per_second"] for s in stats if s["tokens_per_second"]]
+        return {
+            "requests": len(stats),
+            "mean_ttft": sum(ttfts) / len(ttfts) if ttfts else None,
+            "mean_tokens_per_second": sum(speeds) / len(speeds) if speeds else None,
+            "last": stats[-1] if stats else None,
+        }
+
+# Shared by every Note_Taker in the process
+default_client = None
+default_client_lock = threading.Lock()
+
+def get_client():
+    global default_client
+    with default_client_lock:
+        if default_client is None:
+            default_client = LLMClient()
+    return default_client
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import threading
+
+class ResponseCache:
+    """
+    On-disk cache of LLM responses. Entries are addressed by a hash of the model name, the
+    prompt template version and the prompt inputs, so a changed template or model never hits
+    an old entry. One file per entry, a hit bumps the file's modification time and the least
+    recently used files are deleted once the cache grows past max_bytes
+    """
+
+    def __init__(self, directory=".llm_cache", max_bytes=50 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".txt"))
+
+    def key(self, model, template, *inputs):
+        data = json.dumps([model, template, inputs], ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".txt")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)
+            return text
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, text):
+        path = self.path(key)
+        data = text.encode("utf-8")
+        with self.lock:
+            if os.path.exists(path):
+                self.total -= os.path.getsize(path)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+            self.total += len(data)
+            if self.total > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Oldest first until there's some headroom, so this doesn't run on every put
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith(".txt")),
+                         key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.total <= self.max_bytes * 0.9:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+                self.total -= size
+            except FileNotFoundError:
+                pass
+
+# Shared by every Note_Taker in the process so the size total stays right
+default_cache = None
+default_cache_lock = threading.Lock()
+
+def get_cache():
+    global default_cache
+    with default_cache_lock:
+        if default_cache is None:
+            default_cache = ResponseCache()
+    return default_cache
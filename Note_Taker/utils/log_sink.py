@@ -0,0 +1,47 @@
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+class LogSink:
+    """
+    Thread-safe destination for debug messages, passed to Note_Taker as its debug_func.
+    log() can be called from any thread: the full log goes to a rotating file and the
+    console lines are queued until the GUI collects them with drain() on its own thread.
+    Only the last max_lines are kept, both in the queue and in history
+    """
+
+    def __init__(self, log_file="note_taker.log", max_lines=1000, max_bytes=5 * 1024 * 1024, backups=3):
+        self.max_lines = max_lines
+        self.lock = threading.Lock()
+        self.pending = deque(maxlen=max_lines)
+        self.history = deque(maxlen=max_lines)
+
+        self.logger = logging.getLogger(f"note_taker.{log_file}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(asctime)s %(threadName)s: %(message)s"))
+            self.logger.addHandler(handler)
+
+    def log(self, message):
+        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+        self.logger.info(message)
+        with self.lock:
+            # If nobody drains for a while the oldest lines fall off
+            self.pending.append(f"[{timestamp}] {message}")
+
+    def __call__(self, message):
+        self.log(message)
+
+    def drain(self):
+        """
+        Returns the lines logged since the last drain, oldest first
+        """
+        with self.lock:
+            lines = list(self.pending)
+            self.pending.clear()
+            self.history.extend(lines)
+        return lines
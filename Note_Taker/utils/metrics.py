@@ -0,0 +1,226 @@
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds, from a fast transcript write up to a slow LLM response
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Counter:
+    """
+    A value that only goes up, like segments transcribed or tokens generated
+    """
+    kind = "counter"
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def get(self):
+        return self.value
+
+    def samples(self):
+        return [(self.name, self.get())]
+
+    def snapshot(self):
+        return self.get()
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, either set directly or read from function() whenever it's collected
+    """
+    kind = "gauge"
+
+    def __init__(self, name, description, function=None):
+        super().__init__(name, description)
+        self.function = function
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception:
+                return float("nan")
+        return self.value
+
+
+class Histogram:
+    """
+    Counts observations into fixed buckets and keeps their sum, so the mean and rough percentiles
+    can be worked out later without keeping every value
+    """
+    kind = "histogram"
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        # One more than the buckets for everything above the last one
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def mean(self):
+        with self.lock:
+            return self.sum / self.count if self.count else None
+
+    def cumulative(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = 0
+            result = []
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                result.append((bound, total))
+            return result, self.sum, self.count
+
+    def samples(self):
+        buckets, total, count = self.cumulative()
+        samples = [(f'{self.name}_bucket{{le="{format_bound(bound)}"}}', value) for bound, value in buckets]
+        return samples + [(f"{self.name}_sum", total), (f"{self.name}_count", count)]
+
+    def snapshot(self):
+        buckets, total, count = self.cumulative()
+        return {"count": count, "sum": total, "buckets": {format_bound(bound): value for bound, value in buckets}}
+
+def format_bound(bound):
+    return "+Inf" if bound == float("inf") else f"{bound:g}"
+
+def format_value(value):
+    # Prometheus spells these NaN, +Inf and -Inf, Python's nan and inf don't parse
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return f"{value:g}"
+
+
+class Registry:
+    """
+    Holds every metric in the process by name. Asking for a name that already exists returns the
+    existing metric, so modules can declare theirs at import time, and raises ValueError if it's a
+    different kind of metric. write() saves them as Prometheus
+    text, or appends a JSON line when the path ends in .jsonl
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.writer = None
+        self.writing = threading.Event()
+
+    def register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif metric.kind != cls.kind:
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}, not a {cls.kind}")
+            return metric
+
+    def counter(self, name, description):
+        return self.register(Counter, name, description)
+
+    def gauge(self, name, description, function=None):
+        return self.register(Gauge, name, description, function)
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram, name, description, buckets)
+
+    def get(self, name):
+        return self.metrics.get(name)
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name} {format_value(value)}" for name, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def write(self, path):
+        if path.endswith(".jsonl"):
+            with open(path, "a") as f:
+                f.write(json.dumps({"time": time.time(), "metrics": self.snapshot()}) + "\n")
+            return
+        # Replaced in one step so a scraper never reads half a file
+        with open(path + ".tmp", "w") as f:
+            f.write(self.prometheus())
+        os.replace(path + ".tmp", path)
+
+    def start_writer(self, path="metrics.prom", interval=10.0):
+        """
+        Writes the metrics to `path` every `interval` seconds from a background thread
+        """
+        if self.writer is not None and self.writer.is_alive():
+            return self.writer
+        self.writing.clear()
+
+        def run():
+            while not self.writing.wait(interval):
+                try:
+                    self.write(path)
+                except Exception as e:
+                    print(f"Error writing metrics: {str(e)}")
+            self.write(path)
+        self.writer = threading.Thread(target=run)
+        self.writer.daemon = True  # Thread will exit when main program exits
+        self.writer.start()
+        return self.writer
+
+    def stop_writer(self):
+        """
+        Stops the background writer after one last write
+        """
+        self.writing.set()
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+# One registry per process, the functions below add to it
+registry = Registry()
+
+def counter(name, description):
+    return registry.counter(name, description)
+
+def gauge(name, description, function=None):
+    return registry.gauge(name, description, function)
+
+def histogram(name, description, buckets=DEFAULT_BUCKETS):
+    return registry.histogram(name, description, buckets)
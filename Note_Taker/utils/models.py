@@ -0,0 +1,90 @@
+import threading
+import time
+import numpy as np
+from utils import metrics
+from utils.lazy import lazy_import
+
+# Imported on first use, it brings torch with it and takes seconds
+whisper = lazy_import("whisper")
+
+# Loaded models keyed by (name, device, dtype), shared by everything in this process
+models = {}
+# whisper installs kv-cache hooks on the model for each decode, so two transcriptions
+# can't run on the same instance at once. One lock per model serializes them
+model_locks = {}
+# Held per key while that model loads, so loading one model (seconds, or a download) doesn't
+# block transcribing with one that's already loaded. `lock` only guards the dicts
+loading_locks = {}
+lock = threading.Lock()
+
+DEFAULT_MODEL = "base.en"
+# Sample rate of the arrays whisper takes
+WHISPER_FREQ = 16000
+
+INFERENCE_SECONDS = metrics.histogram("note_taker_whisper_inference_seconds", "Time whisper spent on one transcribe call")
+INFERENCE_AUDIO = metrics.counter("note_taker_whisper_audio_seconds_total", "Seconds of audio transcribed by whisper")
+RTF = metrics.histogram("note_taker_whisper_rtf", "Whisper real-time factor, inference time over audio length",
+                        (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5))
+
+def get_model(name=DEFAULT_MODEL, device=None, dtype=None):
+    """
+    Returns the whisper model for this name/device/dtype, loading it on first use.
+    Later calls from any thread get the same instance instead of loading another copy
+    """
+    key = (name, device, dtype)
+    with lock:
+        model = models.get(key)
+        if model is not None:
+            return model
+        loading = loading_locks.setdefault(key, threading.Lock())
+    # A second caller for the same model waits here for the first one's load
+    with loading:
+        with lock:
+            model = models.get(key)
+        if model is None:
+            model = whisper.load_model(name, device=device)
+            if dtype == "float16":
+                model = model.half()
+            with lock:
+                model_locks[key] = threading.Lock()
+                models[key] = model
+    return model
+
+def is_loaded(name=DEFAULT_MODEL, device=None, dtype=None):
+    with lock:
+        return (name, device, dtype) in models
+
+def transcribe(audio, name=DEFAULT_MODEL, device=None, dtype=None, **options):
+    """
+    Transcribes a file name or 16 kHz float32 array with the shared model, returns whisper's result dict
+    """
+    model = get_model(name, device, dtype)
+    with model_locks[(name, device, dtype)]:
+        start = time.perf_counter()
+        result = model.transcribe(audio, **transcribe_options(dtype), **options)
+        elapsed = time.perf_counter() - start
+    INFERENCE_SECONDS.observe(elapsed)
+    if not isinstance(audio, str) and len(audio):
+        seconds = len(audio) / WHISPER_FREQ
+        INFERENCE_AUDIO.inc(seconds)
+        RTF.observe(elapsed / seconds)
+    return result
+
+def transcribe_options(dtype=None):
+    # None keeps whisper's own default (fp16 on GPU, falling back to fp32 on CPU)
+    if dtype is None:
+        return {}
+    return {"fp16": dtype == "float16"}
+
+def warm_up(name=DEFAULT_MODEL, device=None, dtype=None):
+    """
+    Loads the model and runs a second of silence through it so the first real segment isn't delayed
+    """
+    transcribe(np.zeros(16000, dtype=np.float32), name, device, dtype)
+    return get_model(name, device, dtype)
+
+def warm_up_in_background(name=DEFAULT_MODEL, device=None, dtype=None):
+    thread = threading.Thread(target=warm_up, args=(name, device, dtype))
+    thread.daemon = True  # Thread will exit when main program exits
+    thread.start()
+    return thread
@@ -0,0 +1,75 @@
+import re
+
+# Rough token count for prompt budgeting, close enough for English notes
+CHARS_PER_TOKEN = 4
+# Notes without headings are grouped into sections of about this many characters
+FALLBACK_SECTION_CHARS = 1200
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+def split_sections(notes):
+    """
+    Splits markdown notes into sections at headings, ignoring '#' lines inside code blocks.
+    Notes without any headings are split into paragraph groups instead
+    """
+    sections = []
+    current = []
+    in_code = False
+    for line in notes.splitlines(keepends=True):
+        if line.lstrip().startswith("```"):
+            in_code = not in_code
+        if not in_code and re.match(r"#{1,6} ", line) and "".join(current).strip():
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if "".join(current).strip():
+        sections.append("".join(current))
+
+    if len(sections) > 1:
+        return sections
+    # No headings, fall back to groups of paragraphs
+    sections = []
+    group = ""
+    for paragraph in re.split(r"\n\s*\n", notes):
+        if group and len(group) + len(paragraph) > FALLBACK_SECTION_CHARS:
+            sections.append(group)
+            group = ""
+        group += paragraph + "\n\n"
+    if group.strip():
+        sections.append(group)
+    return sections
+
+def keywords(text):
+    return set(word for word in re.findall(r"[a-z][a-z0-9_]+", text.lower()) if len(word) > 3)
+
+def select_sections(sections, transcription, budget_tokens, recent=3):
+    """
+    Picks the sections to show the LLM within budget_tokens: the most recent `recent` sections,
+    then older sections that share the most words with the new transcription. Returned in note order
+    """
+    chosen = set()
+    used = 0
+    for index in range(len(sections) - 1, max(-1, len(sections) - 1 - recent), -1):
+        cost = estimate_tokens(sections[index])
+        if used + cost > budget_tokens and chosen:
+            break
+        chosen.add(index)
+        used += cost
+
+    words = keywords(transcription)
+    ranked = []
+    for index in range(len(sections)):
+        if index not in chosen:
+            overlap = len(words & keywords(sections[index]))
+            if overlap:
+                ranked.append((overlap, index))
+    for overlap, index in sorted(ranked, reverse=True):
+        cost = estimate_tokens(sections[index])
+        if used + cost <= budget_tokens:
+            chosen.add(index)
+            used += cost
+
+    # A single huge section still has to fit
+    text = "".join(sections[index] for index in sorted(chosen))
+    return text[-budget_tokens * CHARS_PER_TOKEN:]
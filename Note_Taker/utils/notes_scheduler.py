@@ -0,0 +1,116 @@
+import threading
+
+class NotesScheduler:
+    """
+    Decides when a lecture's transcript is turned into notes, with at most one generation running at
+    a time. A thread per lecture waits for poke() after each recorded segment and starts generate()
+    once min_tokens of transcript are waiting and the LLM isn't busy, or regardless of the LLM past
+    max_tokens. Transcript that arrives during a generation waits for the next one, which takes all
+    of it in one request. request() runs it now with whatever is pending (the Generate Notes button),
+    and with wait=True raises whatever the generation it waited for raised. stop() is final, the
+    lecture's transcript may be closed right after it
+    """
+
+    def __init__(self, generate, pending_tokens, llm_busy, min_tokens=1000, max_tokens=4000, check_seconds=5.0):
+        self.generate = generate
+        self.pending_tokens = pending_tokens
+        self.llm_busy = llm_busy
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        # The LLM doesn't say when it's free, so look again this often while there's work waiting
+        self.check_seconds = check_seconds
+        self.condition = threading.Condition()
+        self.forced = False
+        self.generating = False
+        self.runs = 0
+        # What the last generation raised, None once one succeeds
+        self.error = None
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            # Once stopped the thread stays down, a late poke() mustn't revive it
+            if self.stopped:
+                return
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True  # Thread will exit when main program exits
+                self.thread.start()
+
+    def poke(self):
+        """
+        New transcript was written, check whether it's time for notes
+        """
+        self.start()
+        with self.condition:
+            self.condition.notify_all()
+
+    def request(self, wait=False, timeout=None):
+        """
+        Generates notes from everything pending as soon as the current generation (if any) is done.
+        With wait=True blocks until that has happened and raises the error if it failed, returns
+        False if the timeout ran out first. Raises RuntimeError once the scheduler was stopped
+        """
+        self.start()
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError("The notes scheduler was stopped")
+            # A generation already running may have started before the latest transcript came in
+            target = self.runs + (2 if self.generating else 1)
+            self.forced = True
+            self.condition.notify_all()
+            if not wait:
+                return True
+            # A stopped scheduler still runs a request made before it stopped, then exits
+            self.condition.wait_for(lambda: self.runs >= target or (self.stopped and not self.forced and not self.generating), timeout)
+            if self.runs < target:
+                return False
+            if self.error is not None:
+                raise self.error
+            return True
+
+    def due(self):
+        tokens = self.pending_tokens()
+        if tokens >= self.max_tokens:
+            return True
+        return tokens >= self.min_tokens and not self.llm_busy()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.forced and not self.stopped:
+                    self.condition.wait(self.check_seconds)
+                # Stopping still lets a requested generation run, the end of a lecture isn't dropped
+                if self.stopped and not self.forced:
+                    return
+                forced, self.forced = self.forced, False
+            try:
+                if not (forced or self.due()):
+                    continue
+                with self.condition:
+                    self.generating = True
+                self.generate()
+                with self.condition:
+                    self.error = None
+            except Exception as e:
+                print(f"Error generating notes: {str(e)}")
+                with self.condition:
+                    self.error = e
+            finally:
+                with self.condition:
+                    if self.generating:
+                        self.generating = False
+                        self.runs += 1
+                    self.condition.notify_all()
+
+    def stop(self, wait=False):
+        """
+        Stops the thread once a requested generation (if any) is done, with wait=True returns after that
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+            thread = self.thread
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join()
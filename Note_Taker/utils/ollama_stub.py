@@ -0,0 +1,166 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSE = ("## Notes\n\n**Key Concepts:** The lecture covered the main ideas of the topic, "
+                    "with examples worked through on the board and a summary at the end.\n")
+EMBED_DIM = 64
+
+def stub_embedding(text):
+    """
+    Hashed bag of words, texts that share words get similar vectors like with a real embedding model
+    """
+    vector = [0.0] * EMBED_DIM
+    for word in re.findall(r"\w+", text.lower()):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % EMBED_DIM] += 1.0
+    return vector
+
+class StubOllama:
+    """
+    Local stand-in for the parts of the Ollama HTTP API this app uses (/api/chat, /api/generate,
+    /api/embed, /api/tags), for exercising the LLM client and the notes pipeline without a model. Responses
+    stream word by word with a configurable time to first token and tokens per second
+    """
+
+    def __init__(self, respond=None, ttft=0.2, tokens_per_second=50.0, host="127.0.0.1", port=0):
+        # respond(request_json) returns the response text, defaults to a canned note
+        self.respond = respond or (lambda request: DEFAULT_RESPONSE)
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(StubHandler):
+            server_stub = stub
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 with chunked bodies so clients can keep their connection open like with the real server
+    protocol_version = "HTTP/1.1"
+    server_stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, body):
+        data = (json.dumps(body) + "\n").encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json({"models": []})
+        else:
+            data = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        stub = self.server_stub
+        chat = self.path == "/api/chat"
+        if self.path == "/api/embed":
+            with stub.lock:
+                stub.requests.append({"path": self.path, "time": time.time(), "request": request})
+            inputs = request.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self.send_json({"model": request.get("model", ""),
+                            "embeddings": [stub_embedding(text) for text in inputs]})
+            return
+        with stub.lock:
+            stub.requests.append({"path": self.path, "time": time.time(), "request": request})
+            stub.active += 1
+            stub.max_active = max(stub.max_active, stub.active)
+        try:
+            # An empty generate is how clients preload a model
+            if not chat and not request.get("prompt"):
+                text = ""
+            else:
+                text = stub.respond(request)
+            self.reply(request, text, chat)
+        finally:
+            with stub.lock:
+                stub.active -= 1
+
+    def reply(self, request, text, chat):
+        stub = self.server_stub
+        model = request.get("model", "")
+        tokens = text.split(" ")
+        tokens = [token + " " for token in tokens[:-1]] + tokens[-1:] if text else []
+        start = time.time()
+
+        def body(content, done):
+            body = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+            if chat:
+                body["message"] = {"role": "assistant", "content": content}
+            else:
+                body["response"] = content
+            if done:
+                elapsed = int((time.time() - start) * 1e9)
+                body.update({"done_reason": "stop", "total_duration": elapsed, "load_duration": 0,
+                             "prompt_eval_count": len(json.dumps(request)) // 4, "prompt_eval_duration": 0,
+                             "eval_count": len(tokens), "eval_duration": max(elapsed, 1)})
+            return body
+
+        if not request.get("stream", True):
+            if tokens:
+                time.sleep(stub.ttft + len(tokens) / stub.tokens_per_second)
+            self.send_json(body(text, True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if tokens:
+            time.sleep(stub.ttft)
+        for token in tokens:
+            self.write_chunk(body(token, False))
+            time.sleep(1.0 / stub.tokens_per_second)
+        self.write_chunk(body("", True))
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
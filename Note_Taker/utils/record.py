@@ -1,26 +1,264 @@
 # import required libraries
-import sounddevice as sd
-from scipy.io.wavfile import write
-import wavio as wv
+import threading
+import time
+from functools import lru_cache
+from math import gcd
+import numpy as np
+from utils.lazy import lazy_import
 
-def record(time, file_name="recording.wav"):
-    # Sampling frequency
-    freq = 44100
+# Only needed once recording starts, importing them up front slows down app start
+sd = lazy_import("sounddevice")
+scipy_signal = lazy_import("scipy.signal")
 
-    # Recording duration
-    duration = time
+# Whisper models expect 16 kHz mono float32
+WHISPER_FREQ = 16000
 
-    # Start recorder with the given values 
-    # of duration and sample frequency
-    recording = sd.rec(int(duration * freq), 
-                    samplerate=freq, channels=2)
+# Default capture format, ask the device for whisper's format so nothing needs converting
+CAPTURE_FREQ = WHISPER_FREQ
+CAPTURE_CHANNELS = 1
 
-    # Record audio for the given number of seconds
-    sd.wait()
+@lru_cache(maxsize=8)
+def design_filter(up, down):
+    # Same kaiser design resample_poly uses by default
+    max_rate = max(up, down)
+    return scipy_signal.firwin(20 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0))
 
-    # This will convert the NumPy array to an audio
-    # file with the given sampling frequency
-    write(file_name, freq, recording)
+class Resampler:
+    """
+    Downmixes (frames, channels) audio to mono and resamples it to whisper's 16 kHz in one pass.
+    The polyphase anti-aliasing filter is designed once here instead of on every segment.
+    process() converts a standalone recording, process_block()/flush() convert a continuous
+    stream that arrives in pieces without filter edge effects at the block boundaries
+    """
 
-    # Convert the NumPy array to audio file
-    wv.write(file_name, recording, freq, sampwidth=2)
\ No newline at end of file
+    def __init__(self, freq, channels, target_freq=WHISPER_FREQ):
+        self.freq = freq
+        self.channels = channels
+        self.target_freq = target_freq
+        common = gcd(int(freq), int(target_freq))
+        self.up = int(target_freq) // common
+        self.down = int(freq) // common
+        # Equal weight per channel, downmixing is then a single matrix-vector product
+        self.weights = np.full(channels, 1.0 / channels, dtype=np.float32)
+        self.taps = None
+        self.context = 0
+        if self.up != self.down:
+            self.taps = design_filter(self.up, self.down)
+            # Input samples needed on each side of a block, half the filter length rounded
+            # up to a multiple of `down` so block edges land exactly on output samples
+            half_filter = len(self.taps) // 2 / self.up
+            self.context = self.down * int(np.ceil(half_filter / self.down))
+        self.pending = np.zeros(self.context, dtype=np.float32)
+
+    def downmix(self, recording):
+        if recording.ndim == 1:
+            return recording
+        if self.channels == 1:
+            return recording[:, 0]
+        return recording @ self.weights
+
+    def process(self, recording):
+        mono = self.downmix(recording)
+        if self.taps is not None:
+            mono = scipy_signal.resample_poly(mono, self.up, self.down, window=self.taps)
+        return mono.astype(np.float32, copy=False)
+
+    def process_block(self, recording):
+        mono = self.downmix(recording)
+        if self.taps is None:
+            return mono.astype(np.float32, copy=False)
+
+        # `pending` holds `context` samples that were already output plus any not yet output,
+        # only the part with a full context on both sides is converted now
+        buffer = np.concatenate((self.pending, mono))
+        end = ((len(buffer) - self.context) // self.down) * self.down
+        if end <= self.context:
+            self.pending = buffer
+            return np.zeros(0, dtype=np.float32)
+        out = scipy_signal.resample_poly(buffer[:end + self.context], self.up, self.down, window=self.taps)
+        self.pending = buffer[end - self.context:]
+        return out[self.context * self.up // self.down:end * self.up // self.down].astype(np.float32)
+
+    def flush(self):
+        """
+        Converts the samples still held back by process_block(), call at the end of the stream
+        """
+        buffer = self.pending
+        self.pending = np.zeros(self.context, dtype=np.float32)
+        if self.taps is None or len(buffer) <= self.context:
+            return np.zeros(0, dtype=np.float32)
+        out = scipy_signal.resample_poly(buffer, self.up, self.down, window=self.taps)
+        end = int(np.ceil(len(buffer) * self.up / self.down))
+        return out[self.context * self.up // self.down:end].astype(np.float32)
+
+def resolve_capture_format(freq=None, channels=None, device=None):
+    """
+    Returns the (freq, channels) to open the device with. Prefers 16 kHz mono, falling back
+    to the device's own sample rate when it can't capture at the requested one
+    """
+    freq = freq or CAPTURE_FREQ
+    channels = channels or CAPTURE_CHANNELS
+    try:
+        sd.check_input_settings(device=device, samplerate=freq, channels=channels, dtype="float32")
+        return freq, channels
+    except Exception:
+        info = sd.query_devices(device, "input")
+        channels = max(1, min(channels, int(info["max_input_channels"])))
+        return int(info["default_samplerate"]), channels
+
+
+class AudioStream:
+    """
+    Continuously captures audio from the input device into a preallocated ring buffer.
+    The device is never stopped between segments, read_segment() just hands off the
+    next block of frames so there are no gaps at segment boundaries
+    """
+
+    def __init__(self, freq=None, channels=None, buffer_seconds=300, device=None):
+        self.freq, self.channels = self.resolve_format(freq, channels, device)
+        self.device = device
+        self.resampler = Resampler(self.freq, self.channels)
+        self.capacity = int(buffer_seconds * self.freq)
+        self.buffer = np.zeros((self.capacity, self.channels), dtype=np.float32)
+        # Both positions count frames since start() and only ever grow,
+        # the index into the buffer is position % capacity
+        self.write_pos = 0
+        self.read_pos = 0
+        self.dropped_frames = 0
+        self.overflows = 0
+        self.stream = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.data_ready = threading.Condition(self.lock)
+
+    def resolve_format(self, freq, channels, device):
+        return resolve_capture_format(freq, channels, device)
+
+    def _callback(self, indata, frames, time_info, status):
+        # Runs on the PortAudio thread, keep it to a copy and a notify
+        if status and status.input_overflow:
+            self.overflows += 1
+        with self.lock:
+            start = self.write_pos % self.capacity
+            end = start + frames
+            if end <= self.capacity:
+                self.buffer[start:end] = indata
+            else:
+                split = self.capacity - start
+                self.buffer[start:] = indata[:split]
+                self.buffer[:end - self.capacity] = indata[split:]
+            self.write_pos += frames
+
+            # The reader fell a whole buffer behind, the oldest audio was overwritten
+            if self.write_pos - self.read_pos > self.capacity:
+                self.dropped_frames += self.write_pos - self.read_pos - self.capacity
+                self.read_pos = self.write_pos - self.capacity
+            self.data_ready.notify_all()
+
+    def start(self):
+        if self.running:
+            return
+        with self.lock:
+            self.write_pos = 0
+            self.read_pos = 0
+        self.stream = sd.InputStream(samplerate=self.freq, channels=self.channels,
+                                     dtype="float32", device=self.device,
+                                     callback=self._callback)
+        self.stream.start()
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        self.stream.stop()
+        self.stream.close()
+        self.stream = None
+        with self.lock:
+            self.running = False
+            # Wake up any reader so it can collect the tail of the recording
+            self.data_ready.notify_all()
+
+    def available(self):
+        with self.lock:
+            return self.write_pos - self.read_pos
+
+    def read(self, frames, timeout=None):
+        """
+        Blocks until `frames` frames are buffered and returns them as a (frames, channels) array.
+        If the timeout expires or the stream is stopped first whatever is buffered is returned,
+        None when there is nothing left
+        """
+        # Can never have more than a full buffer waiting
+        frames = min(frames, self.capacity)
+        with self.lock:
+            self.data_ready.wait_for(
+                lambda: self.write_pos - self.read_pos >= frames or not self.running,
+                timeout=timeout)
+            count = min(frames, self.write_pos - self.read_pos)
+            if count <= 0:
+                return None
+            start = self.read_pos % self.capacity
+            end = start + count
+            if end <= self.capacity:
+                segment = self.buffer[start:end].copy()
+            else:
+                segment = np.concatenate((self.buffer[start:], self.buffer[:end - self.capacity]))
+            self.read_pos += count
+            return segment
+
+    def read_segment(self, seconds, timeout=None):
+        return self.read(int(seconds * self.freq), timeout=timeout)
+
+
+class ReplayAudioStream(AudioStream):
+    """
+    Plays a recording into the ring buffer in place of the input device, `speed` times faster
+    than real time, so the live pipeline can run on canned audio (benchmarks, no microphone).
+    The stream stops itself at the end of the recording and can't be started again after that
+    """
+
+    def __init__(self, recording, freq, speed=1.0, block_seconds=0.1, buffer_seconds=300):
+        recording = np.asarray(recording, dtype=np.float32)
+        if recording.ndim == 1:
+            recording = recording[:, None]
+        self.recording = recording
+        self.speed = speed
+        self.block_frames = max(1, int(block_seconds * freq))
+        self.position = 0
+        self.started_at = None
+        self.finished = False
+        self.thread = None
+        super().__init__(freq, recording.shape[1], buffer_seconds)
+
+    def resolve_format(self, freq, channels, device):
+        return freq, channels
+
+    def start(self):
+        if self.running or self.finished:
+            return
+        with self.lock:
+            self.write_pos = 0
+            self.read_pos = 0
+            self.running = True
+        self.thread = threading.Thread(target=self.play)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def play(self):
+        self.started_at = time.time() - self.position / self.freq / self.speed
+        while self.running and self.position < len(self.recording):
+            block = self.recording[self.position:self.position + self.block_frames]
+            self._callback(block, len(block), None, None)
+            self.position += len(block)
+            # Keep to the replay speed instead of filling the buffer all at once
+            delay = self.started_at + self.position / self.freq / self.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        if self.position >= len(self.recording):
+            self.finished = True
+        self.stop()
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.data_ready.notify_all()
@@ -0,0 +1,202 @@
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from utils.note_context import split_sections
+from utils.transcript_store import TranscriptStore
+
+# .txt files in the notes directory that aren't a lecture's notes
+NOT_NOTES = {"transcription.txt"}
+
+def section_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def fts_query(text):
+    """
+    Turns what the user typed into an FTS5 query: every word has to match, the last one as a
+    prefix so results show up while typing. Quoting keeps characters like - or ( from being syntax
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+class SearchIndex:
+    """
+    Full-text index of every lecture's notes and transcripts in one SQLite FTS5 database. Notes are
+    stored by section and transcripts by segment, each with a hash, so an update only rewrites the
+    sections that changed and only reads transcript segments it hasn't seen. Files already indexed
+    are skipped by modification time and size when the whole directory is indexed
+    """
+
+    def __init__(self, path="note_index.db"):
+        self.path = path
+        self.lock = threading.Lock()
+        # Shared between the GUI and the notes threads, self.lock serializes them
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sections (
+                id INTEGER PRIMARY KEY,
+                lecture TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                text TEXT NOT NULL,
+                UNIQUE (lecture, kind, position));
+            CREATE VIRTUAL TABLE IF NOT EXISTS sections_fts USING fts5(
+                text, content='sections', content_rowid='id', tokenize='porter unicode61');
+            CREATE TRIGGER IF NOT EXISTS sections_insert AFTER INSERT ON sections BEGIN
+                INSERT INTO sections_fts (rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS sections_delete AFTER DELETE ON sections BEGIN
+                INSERT INTO sections_fts (sections_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS sections_update AFTER UPDATE ON sections BEGIN
+                INSERT INTO sections_fts (sections_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                INSERT INTO sections_fts (rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TABLE IF NOT EXISTS sources (
+                path TEXT PRIMARY KEY,
+                signature TEXT NOT NULL);
+        """)
+
+    def transaction(self, work):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def signature(self, path):
+        row = self.conn.execute("SELECT signature FROM sources WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def set_signature(self, path, signature):
+        self.conn.execute("INSERT OR REPLACE INTO sources (path, signature) VALUES (?, ?)", (path, signature))
+
+    def update_notes(self, lecture, notes, source=None, signature=None):
+        """
+        Indexes a lecture's notes, returns how many sections had to be written
+        """
+        sections = split_sections(notes)
+
+        def work():
+            existing = {position: (row_id, old_hash) for row_id, position, old_hash in self.conn.execute(
+                "SELECT id, position, hash FROM sections WHERE lecture = ? AND kind = 'notes'", (lecture,))}
+            changed = 0
+            for position, section in enumerate(sections):
+                new_hash = section_hash(section)
+                row = existing.get(position)
+                if row is None:
+                    self.conn.execute("INSERT INTO sections (lecture, kind, position, hash, text) VALUES (?, 'notes', ?, ?, ?)",
+                                      (lecture, position, new_hash, section))
+                elif row[1] != new_hash:
+                    self.conn.execute("UPDATE sections SET hash = ?, text = ? WHERE id = ?", (new_hash, section, row[0]))
+                else:
+                    continue
+                changed += 1
+            # Compounding usually leaves fewer sections than before
+            removed = self.conn.execute("DELETE FROM sections WHERE lecture = ? AND kind = 'notes' AND position >= ?",
+                                        (lecture, len(sections))).rowcount
+            if source is not None:
+                self.set_signature(source, signature)
+            return changed + removed
+        return self.transaction(work)
+
+    def update_transcript(self, lecture, store):
+        """
+        Indexes the transcript segments added to a TranscriptStore since the last update
+        """
+        source = os.path.abspath(store.path)
+        with self.lock:
+            last = int(self.signature(source) or 0)
+        rows = store.read_since(last)
+        if not rows:
+            return 0
+
+        def work():
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sections (lecture, kind, position, hash, text) VALUES (?, 'transcript', ?, ?, ?)",
+                [(lecture, row_id, section_hash(text), text) for row_id, text in rows])
+            self.set_signature(source, str(rows[-1][0]))
+            return len(rows)
+        return self.transaction(work)
+
+    def index_file(self, path):
+        """
+        Indexes one lecture's notes file, skipped if it hasn't changed since it was last indexed
+        """
+        source = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = f"{stat.st_mtime_ns}:{stat.st_size}"
+        with self.lock:
+            if self.signature(source) == signature:
+                return 0
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            notes = f.read()
+        lecture = os.path.splitext(os.path.basename(path))[0]
+        return self.update_notes(lecture, notes, source, signature)
+
+    def index_directory(self, directory="."):
+        """
+        Brings the index up to date with every notes file and transcript in the directory
+        """
+        changed = 0
+        for path in sorted(glob.glob(os.path.join(directory, "*.txt"))):
+            if os.path.basename(path) not in NOT_NOTES:
+                changed += self.index_file(path)
+        for path in sorted(glob.glob(os.path.join(directory, "*_transcript.db"))):
+            lecture = os.path.basename(path)[:-len("_transcript.db")]
+            store = TranscriptStore(path)
+            try:
+                changed += self.update_transcript(lecture, store)
+            finally:
+                store.close()
+        return changed
+
+    def search(self, query, limit=20, lecture=None):
+        """
+        Best matches first, as dicts with the lecture, kind ("notes" or "transcript"),
+        position, a snippet with the matches in [brackets] and the full text
+        """
+        match = fts_query(query)
+        if match is None:
+            return []
+        sql = """SELECT s.lecture, s.kind, s.position, snippet(sections_fts, 0, '[', ']', ' ... ', 16), s.text
+                 FROM sections_fts JOIN sections s ON s.id = sections_fts.rowid
+                 WHERE sections_fts MATCH ?"""
+        args = [match]
+        if lecture is not None:
+            sql += " AND s.lecture = ?"
+            args.append(lecture)
+        sql += " ORDER BY bm25(sections_fts) LIMIT ?"
+        args.append(limit)
+        with self.lock:
+            rows = self.conn.execute(sql, args).fetchall()
+        return [{"lecture": row[0], "kind": row[1], "position": row[2], "snippet": row[3], "text": row[4]}
+                for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# Shared by every Note_Taker in the process and the GUI
+default_index = None
+default_index_lock = threading.Lock()
+
+def get_search_index():
+    global default_index
+    with default_index_lock:
+        if default_index is None:
+            default_index = SearchIndex()
+    return default_index
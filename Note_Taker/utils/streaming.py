@@ -0,0 +1,105 @@
+import re
+import numpy as np
+
+def normalize(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+class StreamingTranscriber:
+    """
+    Low-latency alternative to fixed segments. Audio is appended as it arrives and every step
+    the window since the last committed word is re-transcribed. A word is committed once two
+    consecutive hypotheses agree on it, anything after that is only a partial hypothesis that
+    may still change. Committed audio is trimmed off the front, so windows stay a few seconds
+    long and overlap with the previous one by whatever hasn't been committed yet
+    """
+
+    def __init__(self, transcribe_fn, on_commit, on_partial=None, freq=16000, max_window=15.0):
+        # transcribe_fn(audio, **options) must return whisper's result dict
+        self.transcribe_fn = transcribe_fn
+        self.on_commit = on_commit
+        self.on_partial = on_partial
+        self.freq = freq
+        self.max_window = max_window
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.offset = 0.0  # stream time of self.audio[0] in seconds
+        self.committed_end = 0.0
+        self.committed = []  # recent committed words, used as prompt and for deduplication
+        self.hypothesis = []  # (start, end, word) not committed yet
+
+    def insert_audio(self, audio):
+        self.audio = np.concatenate((self.audio, audio))
+
+    def prompt(self):
+        return "".join(word for start, end, word in self.committed[-40:])
+
+    def transcribe_window(self):
+        result = self.transcribe_fn(self.audio, initial_prompt=self.prompt(),
+                                    word_timestamps=True, condition_on_previous_text=False)
+        words = []
+        for segment in result["segments"]:
+            for word in segment.get("words", []):
+                words.append((self.offset + word["start"], self.offset + word["end"], word["word"]))
+        return words
+
+    def drop_overlap(self, words):
+        """
+        Removes words that belong to audio that was already committed. First by timestamp,
+        then any leading run of words that repeats the end of the committed text
+        """
+        words = [w for w in words if w[1] > self.committed_end + 0.05]
+        committed = [normalize(w[2]) for w in self.committed[-5:]]
+        for size in range(min(5, len(committed), len(words)), 0, -1):
+            if committed[-size:] == [normalize(w[2]) for w in words[:size]]:
+                return words[size:]
+        return words
+
+    def process(self):
+        """
+        Transcribes the current window, commits the stable prefix and reports the rest as partial
+        """
+        if len(self.audio) == 0:
+            return
+        words = self.drop_overlap(self.transcribe_window())
+
+        # Commit the longest prefix this hypothesis shares with the previous one
+        stable = 0
+        for new, old in zip(words, self.hypothesis):
+            if normalize(new[2]) != normalize(old[2]):
+                break
+            stable += 1
+        self.hypothesis = words[stable:]
+        self.commit(words[:stable])
+
+        # Don't let the window grow forever if the hypotheses keep disagreeing
+        if len(self.audio) / self.freq > self.max_window:
+            self.commit(self.hypothesis)
+            self.hypothesis = []
+            self.trim(self.offset + len(self.audio) / self.freq - 1.0)
+
+        if self.on_partial is not None:
+            self.on_partial("".join(w[2] for w in self.hypothesis).strip())
+
+    def commit(self, words):
+        if not words:
+            return
+        self.committed = (self.committed + words)[-40:]
+        self.committed_end = words[-1][1]
+        self.trim(self.committed_end)
+        self.on_commit("".join(w[2] for w in words).strip())
+
+    def trim(self, until):
+        cut = int((until - self.offset) * self.freq)
+        if cut > 0:
+            self.audio = self.audio[cut:]
+            self.offset += cut / self.freq
+
+    def finish(self):
+        """
+        Commits whatever is left once the audio ends
+        """
+        if len(self.audio) > 0:
+            self.hypothesis = []
+            self.commit(self.drop_overlap(self.transcribe_window()))
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.hypothesis = []
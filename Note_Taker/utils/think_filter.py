@@ -0,0 +1,97 @@
+OPEN_TAG = "<think>"
+CLOSE_TAG = "</think>"
+
+def partial_tag_length(text, tags):
+    """
+    Length of the longest end of `text` that could be the start of one of the tags
+    """
+    for size in range(min(len(text), max(len(tag) for tag in tags) - 1), 0, -1):
+        if any(tag.startswith(text[-size:]) for tag in tags):
+            return size
+    return 0
+
+
+class ThinkFilter:
+    """
+    Removes <think>...</think> reasoning blocks from a streamed LLM response as it arrives.
+    Each chunk is scanned once and, after the first tag, only a possible partial tag at its end
+    is held back, so the clean text can be passed on token by token. Some chat templates open
+    the block themselves, so the response starts with reasoning and the first tag is a </think>.
+    Until the first tag the text is held back, and if that tag is a </think> everything before
+    it is dropped. A response without any tags comes out in one piece when the stream ends
+    """
+
+    def __init__(self):
+        self.inside = False
+        self.carry = ""
+        # Text before the first tag, None once a tag has been seen
+        self.held = []
+
+    def emit(self, out, text):
+        if self.held is None:
+            out.append(text)
+        else:
+            self.held.append(text)
+
+    def first_tag(self, out, tag):
+        if tag == OPEN_TAG:
+            out.extend(self.held)
+        self.held = None
+
+    def feed(self, chunk):
+        text = self.carry + chunk
+        self.carry = ""
+        out = []
+        pos = 0
+        while True:
+            if self.inside:
+                tags = (CLOSE_TAG,)
+                index = text.find(CLOSE_TAG, pos)
+                tag = CLOSE_TAG
+            else:
+                tags = (OPEN_TAG, CLOSE_TAG)
+                open_index = text.find(OPEN_TAG, pos)
+                close_index = text.find(CLOSE_TAG, pos)
+                if close_index != -1 and (open_index == -1 or close_index < open_index):
+                    index, tag = close_index, CLOSE_TAG
+                else:
+                    index, tag = open_index, OPEN_TAG
+
+            if index == -1:
+                keep = partial_tag_length(text[pos:], tags)
+                if not self.inside:
+                    self.emit(out, text[pos:len(text) - keep])
+                self.carry = text[len(text) - keep:]
+                break
+
+            if not self.inside:
+                self.emit(out, text[pos:index])
+                if self.held is not None:
+                    self.first_tag(out, tag)
+            self.inside = tag == OPEN_TAG
+            pos = index + len(tag)
+        return "".join(out)
+
+    def flush(self):
+        """
+        Returns whatever was held back, call once the stream has ended. A partial tag left
+        at the very end is dropped
+        """
+        tail = "".join(self.held) if self.held is not None and not self.inside else ""
+        self.inside = False
+        self.carry = ""
+        self.held = []
+        return tail
+
+def strip_think(chunks):
+    """
+    Generator over the clean text of an iterable of response chunks
+    """
+    think_filter = ThinkFilter()
+    for chunk in chunks:
+        text = think_filter.feed(chunk)
+        if text:
+            yield text
+    tail = think_filter.flush()
+    if tail:
+        yield tail
@@ -1,88 +1,550 @@
-import whisper
-import random
-import os
 import threading
 import queue
-from utils.record import record
+import time
+import weakref
+import numpy as np
+from utils.record import AudioStream, WHISPER_FREQ
+from utils.vad import SpeechSegmenter
+from utils.streaming import StreamingTranscriber
+from utils.transcription_pool import TranscriptionPool, QUEUE_WAIT, TRANSCRIPT_WRITE, SEGMENT_ERRORS
+from utils import models, metrics
 from datetime import datetime
 
+
 class TranscriptionThread(threading.Thread):
     def __init__(self, file_queue):
         super().__init__()
         self.file_queue = file_queue
-        self.model = None
         self.running = True
         self.daemon = True  # Thread will exit when main program exits
         
     def run(self):
-        # Load the model only once when the thread starts
-        self.model = whisper.load_model("base.en")
+        # Load the model once when the thread starts, it's shared with every
+        # other user of the same model in this process
+        models.get_model(model_name, model_device, model_dtype)
         
+        # A segment taken off the queue that didn't fit in the last coalesced batch
+        carry = None
         while self.running:
+            if carry is None:
+                try:
+                    # Get a segment from the queue, wait up to 1 second
+                    carry = self.take(self.file_queue.get(timeout=1))
+                except queue.Empty:
+                    # No audio to process, continue waiting
+                    continue
+
+            settings = current_settings()
+            batch, carry = [carry], None
+            if settings["coalesce"]:
+                batch, carry = self.coalesce(batch)
+            self.transcribe_batch(batch, settings)
+
+    def take(self, item):
+        QUEUE_WAIT.observe((datetime.now() - item[1]).total_seconds())
+        return item
+
+    def coalesce(self, batch):
+        """
+        Adds more queued segments for the same transcript to the batch while they fit in one
+        whisper window, whisper pads every call to 30 seconds so short segments cost as much as long ones
+        """
+        seconds = len(batch[0][2]) / WHISPER_FREQ
+        while True:
             try:
-                # Get a file from the queue, wait up to 1 second
-                file_name = self.file_queue.get(timeout=1)
-                
-                # Process the file
-                dt = datetime.now()
-                dstr = dt.strftime("%A, %d. %B %Y %I:%M%p")
-                result = self.model.transcribe(file_name)
-                transcription = f"{dstr} - {result['text']}\n"
-                
-                # Write to transcription file
-                with open("transcription.txt", "a") as trans_file:
-                    trans_file.write(transcription)
-                
-                # Clean up the audio file
-                os.remove(file_name)
-                self.file_queue.task_done()
-                
+                item = self.take(self.file_queue.get_nowait())
             except queue.Empty:
-                # No files to process, continue waiting
-                continue
-            except Exception as e:
-                print(f"Error in transcription thread: {str(e)}")
+                return batch, None
+            item_seconds = len(item[2]) / WHISPER_FREQ
+            if item[3] != batch[0][3] or seconds + item_seconds + COALESCE_GAP > COALESCE_SECONDS:
+                return batch, item
+            batch.append(item)
+            seconds += item_seconds + COALESCE_GAP
+
+    def transcribe_batch(self, batch, settings):
+        seq, captured_at, audio, write = batch[0]
+        try:
+            if len(batch) > 1:
+                # A little silence between segments so whisper doesn't run words together
+                gap = np.zeros(int(COALESCE_GAP * WHISPER_FREQ), dtype=np.float32)
+                audio = np.concatenate([part for item in batch for part in (item[2], gap)][:-1])
+
+            # Process the segment, whisper takes 16 kHz mono float32 arrays directly
+            dstr = captured_at.strftime("%A, %d. %B %Y %I:%M%p")
+            start = time.perf_counter()
+            result = models.transcribe(audio, settings["model"], model_device, model_dtype, **settings["options"])
+            if controller is not None:
+                controller.observe(len(audio) / WHISPER_FREQ, time.perf_counter() - start)
+            with TRANSCRIPT_WRITE.time():
+                write(f"{dstr} - {result['text']}\n")
+        except Exception as e:
+            SEGMENT_ERRORS.inc()
+            print(f"Error in transcription thread: {str(e)}")
+        finally:
+            for item in batch:
+                # Counted as done even when it failed so file_queue.join() can't hang
+                segment_done(item[0])
+                self.file_queue.task_done()
 
     def stop(self):
         self.running = False
 
-# Global queue and thread instances
+# Whisper model sizes from largest to smallest, the controller steps down this list
+MODEL_SIZES = ["large", "medium", "small", "base", "tiny"]
+# Greedy decoding without whisper's temperature fallback, which re-decodes a segment up to five times
+GREEDY_OPTIONS = {"temperature": 0.0, "beam_size": None, "best_of": None}
+
+def smaller_models(name, steps=2):
+    """
+    The next `steps` smaller whisper models after `name`, keeping the English-only variant if it exists
+    """
+    size = name.split(".")[0].split("-")[0]
+    if size not in MODEL_SIZES:
+        return []
+    english = name.endswith(".en")
+    smaller = MODEL_SIZES[MODEL_SIZES.index(size) + 1:][:steps]
+    return [s + ".en" if english and s != "large" else s for s in smaller]
+
+
+class AdaptiveController:
+    """
+    Keeps transcription close to real time on machines that can't run the configured settings fast
+    enough. Watches the queued audio and whisper's recent real-time factor, and when the estimated
+    time to clear the queue gets above high_seconds it goes one level down: greedy decoding, then
+    coalescing segments into full 30 second windows, then smaller models. Once the queue is nearly
+    empty again it goes back up one level at a time. A level is held for at least hold_seconds, and
+    going back up waits twice as long each time the last step up had to be undone, so a machine
+    right on the edge settles on the lower level. A smaller model is loaded in the background before use.
+    With more than one worker the queue clears that many times faster, and the pool's processes load
+    the smaller models themselves when they start (see TranscriptionPool's preload)
+    """
+
+    def __init__(self, model, options=None, device=None, dtype=None, high_seconds=30, low_seconds=5,
+                 hold_seconds=20, model_steps=2, workers=1):
+        self.workers = workers
+        self.device = device
+        self.dtype = dtype
+        self.high_seconds = high_seconds
+        self.low_seconds = low_seconds
+        self.hold_seconds = hold_seconds
+        options = options or {}
+        self.levels = [
+            {"name": "full", "model": model, "options": options, "coalesce": False},
+            {"name": "greedy", "model": model, "options": {**options, **GREEDY_OPTIONS}, "coalesce": False},
+            {"name": "greedy, coalesced", "model": model, "options": {**options, **GREEDY_OPTIONS}, "coalesce": True},
+        ]
+        for smaller in smaller_models(model, model_steps):
+            self.levels.append({"name": f"greedy, coalesced, {smaller}", "model": smaller,
+                                "options": {**options, **GREEDY_OPTIONS}, "coalesce": True})
+        self.level = 0
+        self.rtf = None
+        self.changed_at = time.time()
+        self.stepped_up_at = None
+        self.backoff = 1
+        self.loading = set()
+        self.lock = threading.Lock()
+
+    def observe(self, audio_seconds, elapsed):
+        """
+        Records how long whisper took for a batch, kept as a moving average
+        """
+        if audio_seconds <= 0:
+            return
+        rtf = elapsed / audio_seconds
+        with self.lock:
+            self.rtf = rtf if self.rtf is None else 0.7 * self.rtf + 0.3 * rtf
+
+    def update(self, queued_seconds, queued_segments):
+        """
+        Picks the level for the next batch from what's waiting in the queue and returns its settings
+        """
+        with self.lock:
+            # How long whisper needs to get through what's queued at the current speed
+            backlog = queued_seconds * (self.rtf if self.rtf is not None else 1.0) / self.workers
+            since = time.time() - self.changed_at
+            if since > self.hold_seconds and backlog > self.high_seconds and self.level < len(self.levels) - 1:
+                self.change(self.level + 1, backlog)
+            elif (since > self.hold_seconds * self.backoff and backlog < self.low_seconds
+                  and queued_segments <= 1 and self.level > 0):
+                self.change(self.level - 1, backlog)
+            return self.settings()
+
+    def change(self, level, backlog):
+        now = time.time()
+        if level < self.level:
+            self.stepped_up_at = now
+        elif self.stepped_up_at is not None and now - self.stepped_up_at < self.hold_seconds * self.backoff * 4:
+            # The last step up didn't hold
+            self.backoff = min(self.backoff * 2, 16)
+        else:
+            self.backoff = 1
+        print(f"Transcription {'falling behind' if level > self.level else 'caught up'} "
+              f"({backlog:.0f}s of work queued), switching to {self.levels[level]['name']}")
+        self.level = level
+        self.changed_at = now
+        # The speed of the old settings says little about the new ones
+        self.rtf = None
+        QUALITY_LEVEL.set(level)
+        QUALITY_CHANGES.inc()
+
+    def settings(self):
+        settings = dict(self.levels[self.level])
+        if self.workers > 1:
+            return settings
+        # Until a smaller model has loaded keep using the nearest one that has
+        for level in range(self.level, -1, -1):
+            model = self.levels[level]["model"]
+            if models.is_loaded(model, self.device, self.dtype):
+                settings["model"] = model
+                break
+            if model not in self.loading:
+                self.loading.add(model)
+                models.warm_up_in_background(model, self.device, self.dtype)
+        return settings
+
+# Global queue and thread instances, the queue carries (seq, captured_at, audio, write) tuples
+# where audio is a float32 buffer, seq the capture order and write where the text goes
 file_queue = queue.Queue()
 transcription_thread = None
+# Sequence number of the next queued segment, taken under pending_lock
+next_segment_seq = 0
+# Capture state of every live CaptureSession
+sessions = weakref.WeakSet()
+
+# More than one worker transcribes in a pool of processes, one model per process
+transcription_workers = 1
+model_name = "base.en"
+model_device = None
+model_dtype = None
+
+# Capture format, None uses whisper's 16 kHz mono when the device supports it
+capture_freq = None
+capture_channels = None
+
+# Drop silence and cut segments at pauses before they reach whisper
+use_vad = True
+# How much audio to pull from the stream at a time while looking for pauses
+vad_block_seconds = 1.0
+
+# Streaming mode re-transcribes the uncommitted audio this often
+streaming_step_seconds = 2.0
+# Its commits are a few words every step, they're joined into transcript lines of about this
+# many characters (at a sentence end) or this many seconds so the transcript isn't mostly timestamps
+streaming_line_chars = 400
+streaming_line_seconds = 30
+
+# Step decoding quality down when transcription falls behind, see AdaptiveController
+use_adaptive = True
+controller = None
+# Options passed to whisper at full quality, whisper's own defaults when empty
+decode_options = {}
+# Coalesced segments are joined into batches of at most this much audio, with a short gap between them
+COALESCE_SECONDS = 30
+COALESCE_GAP = 0.3
+
+# (time queued, seconds of audio) for each segment that isn't transcribed yet, by sequence number
+pending_segments = {}
+pending_lock = threading.Lock()
+# Notified every time a segment is done, for waiting on a session's last segments
+pending_changed = threading.Condition(pending_lock)
+
+def transcription_lag():
+    """
+    How far transcription is behind real time: seconds since the oldest segment still waiting
+    for (or in) whisper was queued, 0 when it's keeping up
+    """
+    with pending_lock:
+        if not pending_segments:
+            return 0.0
+        return time.time() - min(queued for queued, seconds in pending_segments.values())
+
+def pending_audio_seconds():
+    with pending_lock:
+        return sum(seconds for queued, seconds in pending_segments.values())
+
+def first_unwritten_seq():
+    """
+    The lowest sequence number that hasn't been written yet, where a new pool's writer starts.
+    Segments numbered before it were all written (or failed) by an earlier thread or pool
+    """
+    with pending_lock:
+        return min(pending_segments) if pending_segments else next_segment_seq
+
+def segment_done(seq):
+    with pending_changed:
+        pending_segments.pop(seq, None)
+        pending_changed.notify_all()
+    SEGMENTS_TRANSCRIBED.inc()
+
+AUDIO_CAPTURED = metrics.counter("note_taker_audio_captured_seconds_total", "Seconds of audio read from the input stream")
+AUDIO_DROPPED = metrics.gauge("note_taker_audio_dropped_frames", "Frames overwritten before they were read",
+                              lambda: sum(session.audio_stream.dropped_frames for session in list(sessions)
+                                          if session.audio_stream is not None))
+AUDIO_OVERFLOWS = metrics.gauge("note_taker_audio_input_overflows", "Times the input device overran before the capture callback ran",
+                                lambda: sum(session.audio_stream.overflows for session in list(sessions)
+                                            if session.audio_stream is not None))
+SEGMENT_SECONDS = metrics.histogram("note_taker_segment_audio_seconds", "Length of the segments queued for transcription",
+                                    (1, 2, 5, 10, 20, 30, 45, 60, 90, 120))
+SEGMENTS_QUEUED = metrics.counter("note_taker_segments_queued_total", "Segments put on file_queue")
+SEGMENTS_TRANSCRIBED = metrics.counter("note_taker_segments_transcribed_total", "Segments taken off file_queue and finished")
+QUEUE_DEPTH = metrics.gauge("note_taker_queue_depth", "Segments waiting in file_queue", lambda: file_queue.qsize())
+LAG = metrics.gauge("note_taker_transcription_lag_seconds", "How far transcription is behind real time", transcription_lag)
+QUALITY_LEVEL = metrics.gauge("note_taker_quality_level", "AdaptiveController level, 0 is full quality")
+QUALITY_CHANGES = metrics.counter("note_taker_quality_changes_total", "Times the AdaptiveController changed level")
+
+def ensure_controller():
+    global controller
+    if controller is None or controller.levels[0]["model"] != model_name or controller.levels[0]["options"] != decode_options \
+            or controller.workers != transcription_workers:
+        controller = AdaptiveController(model_name, decode_options, model_device, model_dtype, workers=transcription_workers)
+    return controller
+
+def current_settings():
+    """
+    Model, whisper options and whether to coalesce segments for the next batch
+    """
+    if not use_adaptive:
+        return {"name": "full", "model": model_name, "options": decode_options, "coalesce": False}
+    # Pending audio includes the segment about to run, it isn't done yet either
+    return ensure_controller().update(pending_audio_seconds(), file_queue.qsize())
+
+def observe_speed(audio_seconds, elapsed):
+    if controller is not None:
+        controller.observe(audio_seconds, elapsed)
 
 def ensure_transcription_thread():
     global transcription_thread
     if transcription_thread is None or not transcription_thread.is_alive():
-        transcription_thread = TranscriptionThread(file_queue)
+        if transcription_workers > 1:
+            # A pool that died may have taken sequence numbers, start writing after those
+            transcription_thread = TranscriptionPool(file_queue, transcription_workers,
+                                                     model_name, model_device, model_dtype, segment_done,
+                                                     first_seq=first_unwritten_seq(), settings=current_settings,
+                                                     observe=observe_speed,
+                                                     preload=smaller_models(model_name) if use_adaptive else ())
+        else:
+            transcription_thread = TranscriptionThread(file_queue)
         transcription_thread.start()
 
+def warm_up_model(background=True):
+    """
+    Loads the live transcription model at app start, in the background unless background=False.
+    A worker pool loads its own copies
+    """
+    if transcription_workers > 1:
+        return None
+    if not background:
+        return models.warm_up(model_name, model_device, model_dtype)
+    return models.warm_up_in_background(model_name, model_device, model_dtype)
+
 def transcribe(file_name):
-    model = whisper.load_model("base.en")
-    result = model.transcribe(file_name)
+    result = models.transcribe(file_name, model_name, model_device, model_dtype)
     return result["text"]
 
-def record_and_transcribe(seconds):
-    # Ensure the transcription thread is running
-    ensure_transcription_thread()
-    
-    # Generate unique filename
-    file_name = str(random.randint(1000, 100000000)) + ".wav"
-    print(f"Recording for {seconds} seconds")
-    
-    # Record audio
-    record(seconds, file_name)
-    
-    # Add file to transcription queue
-    file_queue.put(file_name)
-
-def retrieve_transcription():
-    trans_file = open("transcription.txt", "r")
-    text = trans_file.read()
-    trans_file.close()
-    return text
-
-def clear_transcription():
-    trans_file = open("transcription.txt", "w")
-    trans_file.write(" ")
-    trans_file.close()
 
+class CaptureSession:
+    """
+    Capture state for one lecture: its input stream, speech segmenter and streaming transcriber.
+    All sessions share file_queue and the transcription thread or pool, so several lectures can
+    record at once from different devices, each writing to its own transcript
+    """
+
+    def __init__(self, device=None, freq=None, channels=None, archive=None):
+        self.device = device
+        self.freq = freq
+        self.channels = channels
+        # An AudioArchive that keeps everything captured, for re-transcribing later
+        self.archive = archive
+        self.audio_stream = None
+        # Set by stop_recording() until start_recording(), so a segment that starts after the
+        # stop doesn't open the device again and record a whole segment nobody waits for
+        self.stopped = False
+        self.stream_lock = threading.Lock()
+        self.segmenter = None
+        self.streamer = None
+        self.lines = None
+        # Sequence number of the last segment this session queued
+        self.last_seq = None
+        sessions.add(self)
+
+    def ensure_audio_stream(self):
+        """
+        Opens the input device if it isn't already, None once recording was stopped
+        """
+        with self.stream_lock:
+            if self.stopped:
+                return None
+            if self.audio_stream is None:
+                self.audio_stream = AudioStream(self.freq or capture_freq, self.channels or capture_channels,
+                                                device=self.device)
+            self.audio_stream.start()
+            return self.audio_stream
+
+    def ensure_segmenter(self, max_seconds):
+        if self.segmenter is None or self.segmenter.max_seconds != max_seconds:
+            self.segmenter = SpeechSegmenter(WHISPER_FREQ, max_seconds=max_seconds)
+        return self.segmenter
+
+    def start_recording(self):
+        with self.stream_lock:
+            self.stopped = False
+
+    def stop_recording(self):
+        with self.stream_lock:
+            self.stopped = True
+            if self.audio_stream is not None:
+                self.audio_stream.stop()
+
+    def queue_segment(self, audio, write):
+        self.last_seq = queue_segment(audio, write)
+
+    def wait_until_written(self, timeout=None):
+        """
+        Blocks until every segment this session queued has been written (or failed), returns
+        False if the timeout ran out first. Segments are written in sequence order, so that's
+        once nothing numbered up to the last one is pending
+        """
+        last_seq = self.last_seq
+        if last_seq is None:
+            return True
+        with pending_changed:
+            return pending_changed.wait_for(lambda: not any(seq <= last_seq for seq in pending_segments), timeout)
+
+    def archive_audio(self, audio, finished=False):
+        """
+        Passes resampled audio on to the archive, finished=True once recording has stopped
+        """
+        if self.archive is None:
+            return audio
+        try:
+            self.archive.append(audio)
+            if finished:
+                self.archive.flush()
+        except Exception as e:
+            # Losing the archive isn't worth losing the lecture over
+            print(f"Error archiving audio: {str(e)}")
+        return audio
+
+    def close(self):
+        self.stop_recording()
+        if self.archive is not None:
+            self.archive.close()
+
+    def record_and_transcribe(self, seconds, write):
+        """
+        Records up to `seconds` of audio and queues it for transcription, write(text) is
+        called with each transcribed segment (a lecture's TranscriptStore.append)
+        """
+        # Ensure the transcription thread is running
+        ensure_transcription_thread()
+        stream = self.ensure_audio_stream()
+        if stream is None:
+            return
+        print(f"Recording for {seconds} seconds")
+
+        if not use_vad:
+            # The stream keeps capturing while this segment is queued
+            segment = stream.read_segment(seconds)
+            if segment is not None:
+                AUDIO_CAPTURED.inc(len(segment) / stream.freq)
+                self.queue_segment(self.archive_audio(stream.resampler.process(segment)), write)
+            return
+
+        # Read in short blocks so a segment is queued as soon as the speaker pauses,
+        # `seconds` is then only the longest a segment is allowed to get
+        vad = self.ensure_segmenter(seconds)
+        remaining = seconds
+        while remaining > 0:
+            block = stream.read_segment(min(vad_block_seconds, remaining))
+            if block is None:
+                # Recording was stopped, send off whatever speech is left
+                for start, audio in vad.feed(self.archive_audio(stream.resampler.flush(), finished=True)) + vad.flush():
+                    self.queue_segment(audio, write)
+                return
+            remaining -= len(block) / stream.freq
+            AUDIO_CAPTURED.inc(len(block) / stream.freq)
+            for start, audio in vad.feed(self.archive_audio(stream.resampler.process_block(block))):
+                self.queue_segment(audio, write)
+
+    def stream_and_transcribe(self, seconds, write, on_partial=None):
+        """
+        Low-latency alternative to record_and_transcribe. Runs for `seconds` re-transcribing short
+        overlapping windows every streaming_step_seconds and appends text to the transcription as soon
+        as it's stable, on_partial gets the not yet committed tail of each hypothesis
+        """
+        stream = self.ensure_audio_stream()
+        if stream is None:
+            return
+        if self.streamer is None:
+            self.streamer = StreamingTranscriber(stream_window, None)
+        streamer = self.streamer
+        if self.lines is None:
+            self.lines = CommittedLines(write)
+        self.lines.write = write
+        streamer.on_commit = self.lines.add
+        streamer.on_partial = on_partial
+
+        step = int(streaming_step_seconds * stream.freq)
+        remaining = int(seconds * stream.freq)
+        while remaining > 0:
+            # Take everything that piled up if the last window took longer than a step
+            block = stream.read(max(step, stream.available()))
+            if block is None:
+                streamer.insert_audio(self.archive_audio(stream.resampler.flush(), finished=True))
+                streamer.finish()
+                self.lines.flush()
+                return
+            remaining -= len(block)
+            AUDIO_CAPTURED.inc(len(block) / stream.freq)
+            streamer.insert_audio(self.archive_audio(stream.resampler.process_block(block)))
+            streamer.process()
+        # Don't hold a half line back from the notes past the end of this segment
+        self.lines.flush()
+
+def stream_window(audio, **options):
+    return models.transcribe(audio, model_name, model_device, model_dtype, **options)
+
+
+
+class CommittedLines:
+    """
+    Joins the streaming transcriber's commits into transcript lines with one timestamp each,
+    the time the line's first words were committed. A line is written once it ends a sentence
+    and is long or old enough, or regardless once it's twice that long
+    """
+
+    def __init__(self, write):
+        self.write = write
+        self.parts = []
+        self.started = None
+
+    def add(self, text):
+        if not text:
+            return
+        if not self.parts:
+            self.started = datetime.now()
+        self.parts.append(text)
+        line = " ".join(self.parts)
+        age = (datetime.now() - self.started).total_seconds()
+        sentence_end = line.endswith((".", "?", "!"))
+        if (sentence_end and (len(line) >= streaming_line_chars or age >= streaming_line_seconds)) \
+                or len(line) >= 2 * streaming_line_chars:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            dstr = self.started.strftime("%A, %d. %B %Y %I:%M%p")
+            self.write(f"{dstr} - {' '.join(self.parts)}\n")
+        self.parts = []
+
+def queue_segment(audio, write):
+    global next_segment_seq
+    # Add audio to transcription queue, numbered so a worker pool can put results back in order
+    with pending_lock:
+        seq = next_segment_seq
+        next_segment_seq += 1
+        pending_segments[seq] = (time.time(), len(audio) / WHISPER_FREQ)
+    SEGMENTS_QUEUED.inc()
+    SEGMENT_SECONDS.observe(len(audio) / WHISPER_FREQ)
+    file_queue.put((seq, datetime.now(), audio, write))
+    return seq
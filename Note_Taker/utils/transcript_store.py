@@ -0,0 +1,93 @@
+import sqlite3
+import threading
+import time
+
+class TranscriptStore:
+    """
+    Append-only transcript for one lecture, kept in SQLite next to the notes file.
+    Segments are only ever appended, whoever turns them into notes reads them through a
+    cursor: peek() returns everything after the cursor with the id of the last segment, and
+    commit(last_id) moves the cursor once the notes from it are written. If the notes fail the
+    cursor stays put and the same text is picked up next time, and a segment appended in between
+    is after last_id so it's never skipped. The length of the text not committed yet is kept as a
+    running counter, so checking it doesn't read anything
+    """
+
+    def __init__(self, path, cursor="notes"):
+        self.path = path
+        self.cursor = cursor
+        self.lock = threading.Lock()
+        # Shared between the recording, transcription and notes threads, self.lock serializes them
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS segments (
+                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 created REAL NOT NULL,
+                                 text TEXT NOT NULL)""")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS cursors (
+                                 name TEXT PRIMARY KEY,
+                                 position INTEGER NOT NULL)""")
+        self.conn.execute("INSERT OR IGNORE INTO cursors (name, position) VALUES (?, 0)", (cursor,))
+        # Counted once when the store is opened, kept up to date by append() and commit() after that
+        self.pending = self.conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(text)), 0) FROM segments WHERE id > (SELECT position FROM cursors WHERE name = ?)",
+            (cursor,)).fetchone()[0]
+
+    def append(self, text):
+        with self.lock:
+            row = self.conn.execute("INSERT INTO segments (created, text) VALUES (?, ?)", (time.time(), text))
+            self.pending += len(text)
+            return row.lastrowid
+
+    def pending_length(self):
+        """
+        Characters appended after the cursor
+        """
+        return self.pending
+
+    def peek(self):
+        """
+        Returns (text, last_id): the text after the cursor without moving it, and the id to pass
+        to commit() once it's been used. last_id is None when there's nothing new
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, text FROM segments WHERE id > (SELECT position FROM cursors WHERE name = ?) ORDER BY id",
+                (self.cursor,)).fetchall()
+        if not rows:
+            return "", None
+        return "".join(row[1] for row in rows), rows[-1][0]
+
+    def commit(self, last_id):
+        """
+        Moves the cursor past last_id (from peek), the segments up to it count as used
+        """
+        if last_id is None:
+            return
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                position = self.conn.execute("SELECT position FROM cursors WHERE name = ?",
+                                             (self.cursor,)).fetchone()[0]
+                used = 0
+                if last_id > position:
+                    used = self.conn.execute("SELECT COALESCE(SUM(LENGTH(text)), 0) FROM segments WHERE id > ? AND id <= ?",
+                                             (position, last_id)).fetchone()[0]
+                    self.conn.execute("UPDATE cursors SET position = ? WHERE name = ?", (last_id, self.cursor))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.pending -= used
+
+    def read_since(self, after_id=0):
+        """
+        Returns (id, text) for every segment after after_id, whether consumed or not
+        """
+        with self.lock:
+            return self.conn.execute("SELECT id, text FROM segments WHERE id > ? ORDER BY id",
+                                     (after_id,)).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
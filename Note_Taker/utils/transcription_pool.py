@@ -0,0 +1,183 @@
+import os
+import queue
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import partial
+from utils import metrics
+from utils.models import WHISPER_FREQ
+
+# Each worker process loads its own model once in init_worker
+worker_model = None
+
+# Shared with TranscriptionThread, utils.transcribe imports them from here since it imports this
+# module first. Whisper's own timings stay in the worker processes
+QUEUE_WAIT = metrics.histogram("note_taker_queue_wait_seconds", "Time a segment waited in file_queue before a worker took it")
+TRANSCRIPT_WRITE = metrics.histogram("note_taker_transcript_write_seconds", "Time to write one transcribed segment")
+SEGMENT_ERRORS = metrics.counter("note_taker_segment_errors_total", "Segments that failed to transcribe")
+
+def init_worker(model_name, threads, device=None, dtype=None, preload=()):
+    global worker_model
+    import torch
+    from utils import models
+    # Split the cores between the workers instead of every process trying to use all of them
+    torch.set_num_threads(threads)
+    models.get_model(model_name, device, dtype)
+    worker_model = (model_name, device, dtype)
+    # Smaller models the AdaptiveController may switch to, loading one only once it's needed
+    # would stall every worker just when transcription is already behind
+    for name in preload:
+        models.warm_up_in_background(name, device, dtype)
+
+def transcribe_in_worker(audio, model_name=None, options=None):
+    """
+    Transcribes with the worker's model, or with model_name which the worker loads the first time it's asked for
+    """
+    from utils import models
+    name, device, dtype = worker_model
+    return models.transcribe(audio, model_name or name, device, dtype, **(options or {}))["text"]
+
+def transcribe_timed_in_worker(audio, model_name=None, options=None):
+    start = time.perf_counter()
+    text = transcribe_in_worker(audio, model_name, options)
+    return text, time.perf_counter() - start
+
+
+class OrderedWriter:
+    """
+    Writes results in sequence order even when they finish out of order. Results that
+    arrive early are held until every earlier sequence number has been written
+    """
+
+    def __init__(self, first_seq=0):
+        self.next_seq = first_seq
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def submit(self, seq, text, write):
+        """
+        Hands in the result for `seq` to be passed to write(text) in order, None marks
+        a segment that failed so it doesn't hold up the rest. A write that raises is counted
+        and skipped, it may be for a later segment than `seq` and mustn't stall the ones after it
+        """
+        with self.lock:
+            self.pending[seq] = (text, write)
+            while self.next_seq in self.pending:
+                text, write = self.pending.pop(self.next_seq)
+                try:
+                    if text is not None:
+                        write(text)
+                except Exception as e:
+                    SEGMENT_ERRORS.inc()
+                    print(f"Error writing transcript segment {self.next_seq}: {str(e)}")
+                finally:
+                    self.next_seq += 1
+
+
+class TranscriptionPool(threading.Thread):
+    """
+    Drop-in replacement for TranscriptionThread that fans segments out over a pool of worker
+    processes, each with its own whisper model. Processes get around the GIL and torch's own
+    thread contention, so throughput scales with the number of cores. settings() is asked for the
+    model and whisper options of each segment (the AdaptiveController's level) and observe(audio_seconds,
+    elapsed) gets whisper's time for it, and every worker loads the `preload` models it may be switched to
+    in the background. Segments aren't coalesced here, every one goes to its own worker
+    """
+
+    def __init__(self, file_queue, workers=2, model_name="base.en", device=None, dtype=None, done=None, first_seq=0,
+                 settings=None, observe=None, preload=()):
+        super().__init__()
+        self.file_queue = file_queue
+        # done(seq) is called once a segment has been written or has failed
+        self.done = done
+        self.settings = settings
+        self.observe = observe
+        self.preload = tuple(preload)
+        self.workers = workers
+        self.model_name = model_name
+        self.device = device
+        self.dtype = dtype
+        # Sequence numbers are shared by the whole process, so this pool's first segment
+        # isn't necessarily 0 (a pool before it, or the single thread, took some)
+        self.writer = OrderedWriter(first_seq)
+        # Keep only a couple of segments per worker in flight, the rest wait in file_queue
+        self.in_flight = threading.Semaphore(workers * 2)
+        self.running = True
+        self.daemon = True  # Thread will exit when main program exits
+
+    def start_executor(self):
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=init_worker, initargs=(self.model_name, threads, self.device, self.dtype, self.preload))
+
+    def run(self):
+        executor = self.start_executor()
+        try:
+            while self.running:
+                try:
+                    seq, captured_at, audio, write = self.file_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                QUEUE_WAIT.observe((datetime.now() - captured_at).total_seconds())
+                settings = self.segment_settings()
+                args = (transcribe_timed_in_worker, audio, settings["model"], settings["options"])
+                self.in_flight.acquire()
+                try:
+                    future = executor.submit(*args)
+                except BrokenProcessPool:
+                    # A worker died (killed, out of memory). Segments already in the pool fail
+                    # through finished(), this one never ran so it goes to a fresh pool with the rest
+                    executor.shutdown(wait=False)
+                    executor = self.start_executor()
+                    try:
+                        future = executor.submit(*args)
+                    except BrokenProcessPool as e:
+                        self.in_flight.release()
+                        self.fail(seq, write, e)
+                        continue
+                future.add_done_callback(partial(self.finished, seq, captured_at, len(audio) / WHISPER_FREQ, write))
+        finally:
+            executor.shutdown(wait=True)
+
+    def segment_settings(self):
+        if self.settings is not None:
+            try:
+                return self.settings()
+            except Exception as e:
+                print(f"Error choosing transcription settings: {str(e)}")
+        # The worker's own model and whisper's defaults
+        return {"model": None, "options": {}}
+
+    def finished(self, seq, captured_at, audio_seconds, write, future):
+        self.in_flight.release()
+        try:
+            text, elapsed = future.result()
+            if self.observe is not None:
+                self.observe(audio_seconds, elapsed)
+            dstr = captured_at.strftime("%A, %d. %B %Y %I:%M%p")
+            text = f"{dstr} - {text}\n"
+            with TRANSCRIPT_WRITE.time():
+                self.writer.submit(seq, text, write)
+        except Exception as e:
+            self.fail(seq, write, e)
+            return
+        self.segment_finished(seq)
+
+    def fail(self, seq, write, error):
+        SEGMENT_ERRORS.inc()
+        print(f"Error in transcription worker: {str(error)}")
+        try:
+            self.writer.submit(seq, None, write)
+        finally:
+            self.segment_finished(seq)
+
+    def segment_finished(self, seq):
+        if self.done is not None:
+            self.done(seq)
+        self.file_queue.task_done()
+
+    def stop(self):
+        self.running = False
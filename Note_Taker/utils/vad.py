@@ -0,0 +1,168 @@
+import numpy as np
+from collections import deque
+
+# Analysis frame length, speech is roughly stationary over 30 ms
+FRAME_SECONDS = 0.03
+
+def frame_features(frames):
+    """
+    Returns the energy in dB and the spectral flatness of each row of a (n, frame_len) array.
+    Speech is loud and tonal (low flatness), room noise is quiet or flat like a fan or hiss
+    """
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(frames.shape[1]), axis=1)) + 1e-10
+    flatness = np.exp(np.mean(np.log(spectrum), axis=1)) / np.mean(spectrum, axis=1)
+    return energy_db, flatness
+
+
+class SpeechSegmenter:
+    """
+    Lightweight energy/spectral voice activity detector that sits between the recorder and the
+    transcription queue. feed() takes 16 kHz mono audio in blocks of any size and returns the
+    finished speech segments as (start_seconds, audio) tuples. Silence is dropped and segments
+    are cut at pauses, only falling back to a cut at the quietest frame when one gets too long.
+    A frame is speech when it's margin_db above the room's noise floor and above threshold_db,
+    which only matters for very quiet inputs like a laptop mic at low gain. The noise floor
+    drops to any quieter frame straight away but only rises with the non-speech frames, so a
+    long stretch of speech can't lift it to the speaker's level. The exception is a steady fan
+    or air conditioner loud enough that every frame counts as speech: once nothing in the last
+    floor_seconds was quieter, the floor creeps up towards that level by rise_db_per_second
+    """
+
+    def __init__(self, freq=16000, max_seconds=60, min_speech=0.3, min_silence=0.6, pad=0.2,
+                 threshold_db=-60, margin_db=12, max_flatness=0.5, floor_seconds=30, rise_db_per_second=0.25):
+        self.freq = freq
+        self.max_seconds = max_seconds
+        self.frame_len = int(freq * FRAME_SECONDS)
+        self.max_frames = int(max_seconds / FRAME_SECONDS)
+        self.min_speech_frames = int(min_speech / FRAME_SECONDS)
+        self.min_silence_frames = int(min_silence / FRAME_SECONDS)
+        self.pad_frames = int(pad / FRAME_SECONDS)
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.max_flatness = max_flatness
+        self.floor_frames = int(floor_seconds / FRAME_SECONDS)
+        self.max_rise_db = rise_db_per_second * FRAME_SECONDS
+
+        # Not the first frame's energy: if capture starts mid-sentence that would put the
+        # threshold above speech until the first pause. Start at threshold_db and let the
+        # quiet frames pull the floor to the room's level
+        self.noise_floor_db = threshold_db - margin_db
+        self.smoothed_db = None
+        # (frame, smoothed energy) with increasing energies, the front is the window's minimum
+        self.floor_window = deque()
+        self.leftover = np.zeros(0, dtype=np.float32)
+        self.position = 0  # frames seen so far
+        self.preroll = deque(maxlen=self.pad_frames)
+        self.reset_segment()
+
+    def reset_segment(self):
+        self.in_speech = False
+        self.segment = []
+        self.segment_energy = []
+        self.segment_start = 0
+        self.speech_frames = 0
+        self.silence_run = 0
+
+    def is_speech(self, energy_db, flatness):
+        threshold = max(self.threshold_db, self.noise_floor_db + self.margin_db)
+        return energy_db > threshold and flatness < self.max_flatness
+
+    def update_noise_floor(self, energy_db, speech):
+        if self.smoothed_db is None:
+            self.smoothed_db = energy_db
+        else:
+            self.smoothed_db = 0.7 * self.smoothed_db + 0.3 * energy_db
+        while self.floor_window and self.floor_window[-1][1] >= self.smoothed_db:
+            self.floor_window.pop()
+        self.floor_window.append((self.position, self.smoothed_db))
+        if self.floor_window[0][0] <= self.position - self.floor_frames:
+            self.floor_window.popleft()
+        window_min = self.floor_window[0][1]
+        if self.smoothed_db < self.noise_floor_db:
+            # The room got quieter
+            self.noise_floor_db = self.smoothed_db
+        elif not speech:
+            # Slow average over non-speech frames
+            self.noise_floor_db = 0.98 * self.noise_floor_db + 0.02 * energy_db
+        elif self.position >= self.floor_frames:
+            # Nothing quieter for a whole window, most likely steady noise rather than a speaker
+            self.noise_floor_db = min(window_min, self.noise_floor_db + self.max_rise_db)
+
+    def feed(self, audio):
+        audio = np.concatenate((self.leftover, np.asarray(audio, dtype=np.float32)))
+        count = len(audio) // self.frame_len
+        self.leftover = audio[count * self.frame_len:]
+        if count == 0:
+            return []
+        frames = audio[:count * self.frame_len].reshape(count, self.frame_len)
+        energy_db, flatness = frame_features(frames)
+
+        finished = []
+        for frame, energy, flat in zip(frames, energy_db, flatness):
+            speech = self.is_speech(energy, flat)
+            self.update_noise_floor(energy, speech)
+            if not self.in_speech:
+                if speech:
+                    # Start a segment, keeping a little audio from before the onset
+                    self.in_speech = True
+                    self.segment_start = self.position - len(self.preroll)
+                    self.segment = list(self.preroll)
+                    self.segment_energy = [self.threshold_db] * len(self.preroll)
+                    self.preroll.clear()
+                    self.segment.append(frame)
+                    self.segment_energy.append(energy)
+                    self.speech_frames = 1
+                    self.silence_run = 0
+                else:
+                    self.preroll.append(frame)
+            else:
+                self.segment.append(frame)
+                self.segment_energy.append(energy)
+                if speech:
+                    self.speech_frames += 1
+                    self.silence_run = 0
+                else:
+                    self.silence_run += 1
+                    if self.silence_run >= self.min_silence_frames:
+                        finished.extend(self.end_segment())
+                if self.in_speech and len(self.segment) >= self.max_frames:
+                    finished.extend(self.split_long_segment())
+            self.position += 1
+        return finished
+
+    def end_segment(self):
+        # Keep pad_frames of the trailing silence, the rest is dropped
+        keep = len(self.segment) - self.silence_run + self.pad_frames
+        result = self.make_segment(self.segment[:keep], self.segment_start)
+        self.reset_segment()
+        return result
+
+    def split_long_segment(self):
+        # Cut at the quietest frame in the last quarter so words aren't split in half
+        search_from = (len(self.segment) * 3) // 4
+        cut = search_from + int(np.argmin(self.segment_energy[search_from:]))
+        result = self.make_segment(self.segment[:cut], self.segment_start)
+        self.segment_start += cut
+        self.segment = self.segment[cut:]
+        self.segment_energy = self.segment_energy[cut:]
+        self.speech_frames = len(self.segment)
+        return result
+
+    def make_segment(self, frames, start_frame):
+        if not frames or self.speech_frames < self.min_speech_frames:
+            return []
+        return [(start_frame * FRAME_SECONDS, np.concatenate(frames))]
+
+    def flush(self):
+        """
+        Returns the segment in progress, if any, call when the recording stops
+        """
+        result = []
+        if self.in_speech:
+            keep = len(self.segment) - max(0, self.silence_run - self.pad_frames)
+            result = self.make_segment(self.segment[:keep], self.segment_start)
+        self.reset_segment()
+        self.preroll.clear()
+        self.leftover = np.zeros(0, dtype=np.float32)
+        return result